@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MultiLLMRoutingRAG.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+application = get_asgi_application()
+
+# index jobs run in this process, resubmit the ones lost by the previous one (eg on reload)
+from app.utils.index_jobs import resume_index_jobs  # noqa: E402
+
+resume_index_jobs()
+
+# serve static files in development, like runserver does for WSGI
+from django.conf import settings  # noqa: E402
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler  # noqa: E402
+
+if settings.DEBUG:
+    application = ASGIStaticFilesHandler(application)
\ No newline at end of file
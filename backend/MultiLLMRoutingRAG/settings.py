@@ -129,6 +129,53 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # Path for vector DB indexes
 INDEXES_DIR = os.path.join(MEDIA_ROOT, 'indexes') 
 
+# Memory budget (in bytes) for loaded vector DB indexes cached in each process
+INDEX_CACHE_MAX_BYTES = int(os.environ.get('INDEX_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Background index building: number of indexes built at once, and chunks per embedding call / embedding calls in flight per index
+INDEXING_WORKERS = int(os.environ.get('INDEXING_WORKERS', 2))
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 256))
+EMBEDDING_CONCURRENCY = int(os.environ.get('EMBEDDING_CONCURRENCY', 4))
+
+# Index type by knowledgebase size (in chunks): exact (flat) search up to FLAT_INDEX_MAX_VECTORS, HNSW up to
+# HNSW_INDEX_MAX_VECTORS and IVF-PQ (compressed vectors) above. Default search depth of HNSW (efSearch) and
+# IVF-PQ (nprobe) indexes, both can be set per query
+FLAT_INDEX_MAX_VECTORS = int(os.environ.get('FLAT_INDEX_MAX_VECTORS', 20_000))
+HNSW_INDEX_MAX_VECTORS = int(os.environ.get('HNSW_INDEX_MAX_VECTORS', 200_000))
+INDEX_EF_SEARCH = int(os.environ.get('INDEX_EF_SEARCH', 64))
+INDEX_NPROBE = int(os.environ.get('INDEX_NPROBE', 16))
+
+# Background chat summaries: number of chat summaries updated at once
+SUMMARY_WORKERS = int(os.environ.get('SUMMARY_WORKERS', 2))
+
+# Encoder of the semantic router: "openai", "hashing" (local, no network) or "fastembed" (local model, optional dependency)
+SEMANTIC_ROUTER_ENCODER = os.environ.get('SEMANTIC_ROUTER_ENCODER', 'openai')
+# Minimum similarity of a query to a route's utterances for the semantic route to be chosen, the encoder's own
+# default if not set (the "hashing" one is calibrated on the semantic routes in app/tests/test_encoders.py)
+SEMANTIC_ROUTER_SCORE_THRESHOLD = float(os.environ['SEMANTIC_ROUTER_SCORE_THRESHOLD']) if os.environ.get('SEMANTIC_ROUTER_SCORE_THRESHOLD') else None
+
+# Precomputed semantic route utterance embeddings, keyed by a hash of the utterances and encoder
+ROUTE_EMBEDDINGS_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'route_embeddings')
+
+# Semantic response cache (opt-in): reuse the answer to an earlier query of the same chat when the new query is
+# at least this similar (cosine) and the same context is retrieved for it
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = float(os.environ.get('RESPONSE_CACHE_SIMILARITY_THRESHOLD', 0.95))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 24 * 60 * 60))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 256))  # per chat
+
+# Hedged requests for the availability optimization metric (opt-in): when the preferred model has not answered after
+# this quantile of its observed latency (or HEDGE_DELAY seconds, until it has been observed), also ask the other model
+HEDGING_ENABLED = os.environ.get('HEDGING_ENABLED', 'false').lower() == 'true'
+HEDGE_DELAY = float(os.environ.get('HEDGE_DELAY', 2.0))
+HEDGE_LATENCY_QUANTILE = float(os.environ.get('HEDGE_LATENCY_QUANTILE', 0.95))
+
+# Self-hosted (ollama) LLM server: pooled keep-alive connections, timeouts in seconds
+SELF_HOSTED_LLM_BASE_URL = os.environ.get('SELF_HOSTED_LLM_BASE_URL', 'https://llm.chatwards.ai')
+SELF_HOSTED_LLM_MAX_CONNECTIONS = int(os.environ.get('SELF_HOSTED_LLM_MAX_CONNECTIONS', 10))
+SELF_HOSTED_LLM_CONNECT_TIMEOUT = float(os.environ.get('SELF_HOSTED_LLM_CONNECT_TIMEOUT', 5))
+SELF_HOSTED_LLM_READ_TIMEOUT = float(os.environ.get('SELF_HOSTED_LLM_READ_TIMEOUT', 60))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MultiLLMRoutingRAG.settings')
 
 application = get_wsgi_application()
+
+# index jobs run in this process, resubmit the ones lost by the previous one (eg on reload)
+from app.utils.index_jobs import resume_index_jobs  # noqa: E402
+
+resume_index_jobs()
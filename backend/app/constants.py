@@ -69,3 +69,56 @@ SEMANTIC_ROUTES = [
 
 DEFAULT_STRONG_MODEL_NAME = LLMName.GPT_4_O
 DEFAULT_WEAK_MODEL_NAME = LLMName.LLAMA3_8B
+
+# RouteLLM router scoring query difficulty and its checkpoint, the threshold below is calibrated for them
+ROUTELLM_ROUTER = "mf"
+ROUTELLM_MF_CHECKPOINT = "routellm/mf_gpt4_augmented"
+
+# calibrated RouteLLM "mf" threshold to route approximately 50% of the queries to the strong model, for more details see https://github.com/lm-sys/RouteLLM?tab=readme-ov-file#threshold-calibration
+ROUTELLM_MF_THRESHOLD = 0.11593
+
+# routing decisions of recent queries are reused for up to ROUTING_CACHE_TTL seconds
+ROUTING_CACHE_MAX_SIZE = 10_000
+ROUTING_CACHE_TTL = 60 * 60
+
+# number of queries embedded per request when routing queries in bulk
+ROUTING_BATCH_SIZE = 256
+
+# prompt token budget of each model (system prompt, history, context and query), well below their context windows
+# so that prompts stay cheap and fast to prefill and leave room for the response
+PROMPT_TOKEN_BUDGETS = {
+    LLMName.GPT_3_5_TURBO: 3_000,
+    LLMName.GPT_4: 6_000,
+    LLMName.GPT_4_O: 6_000,
+    LLMName.LLAMA3_8B: 3_000,
+}
+DEFAULT_PROMPT_TOKEN_BUDGET = 3_000
+
+# share of the budget (after the system prompt and query) the chat history may take, the context gets the rest
+HISTORY_TOKEN_SHARE = 0.3
+
+# candidates packed into the prompt by recency (history) and relevance (retrieved chunks)
+HISTORY_CANDIDATES = 10
+RETRIEVAL_CANDIDATES = 8
+RETRIEVAL_SCORE_THRESHOLD = 0.6
+
+# rolling chat summaries: the latest messages kept verbatim in the prompt (the last two turns), the older ones are
+# folded into the chat's summary at most SUMMARY_BATCH_SIZE at a time, and the summary's length in words
+SUMMARY_RECENT_MESSAGES = 4
+SUMMARY_BATCH_SIZE = 20
+SUMMARY_MAX_WORDS = 250
+
+# approximate nearest neighbor indexes of large knowledgebases (see `app.utils.ann_index`): HNSW graph degree and
+# build-time search depth, IVF-PQ dimensions per PQ sub-quantizer (16 dimensions in 1 byte), candidates re-ranked
+# per result and points per list for training the coarse quantizer
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+IVF_PQ_DIMENSIONS_PER_SUBQUANTIZER = 16
+IVF_PQ_BITS = 8
+IVF_PQ_REFINE_K_FACTOR = 4
+IVF_TRAINING_POINTS_PER_LIST = 40
+
+# recall/latency report of an index, measured at build time on a sample of its vectors for each search setting
+INDEX_REPORT_QUERIES = 100
+INDEX_REPORT_NPROBES = (1, 4, 8, 16, 32, 64, 128)
+INDEX_REPORT_EF_SEARCHES = (16, 32, 64, 128, 256)
@@ -18,6 +18,24 @@ class OptimizationMetric(str, Enum):
     AVAILABILITY = "availability"
 
 
+class IndexStatus(str, Enum):
+    PENDING = "pending"
+    READY = "ready"
+    FAILED = "failed"
+
+
+class IndexType(str, Enum):
+    FLAT = "flat"
+    HNSW = "hnsw"
+    IVF_PQ = "ivf_pq"
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
 class Role(str, Enum):
     SYSTEM = "system"
     USER = "user"
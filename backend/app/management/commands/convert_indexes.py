@@ -0,0 +1,31 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.utils.index_store import convert_index
+
+
+class Command(BaseCommand):
+    help = "Converts chat indexes saved with a pickled docstore to the memory-mapped, pickle-free format"
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(settings.INDEXES_DIR):
+            self.stdout.write("No indexes to convert")
+            return
+
+        converted, failed = 0, 0
+        for name in sorted(os.listdir(settings.INDEXES_DIR)):
+            chat_id, extension = os.path.splitext(name)
+            if extension != ".index" or not chat_id.isdigit():
+                continue
+
+            try:
+                if convert_index(int(chat_id)):
+                    converted += 1
+                    self.stdout.write(f"Converted index of chat {chat_id}")
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Error converting index of chat {chat_id}: {e}")
+
+        self.stdout.write(self.style.SUCCESS(f"{converted} indexes converted") if not failed else self.style.WARNING(f"{converted} indexes converted, {failed} failed"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from app.utils.chat import warmup
+
+
+class Command(BaseCommand):
+    help = "Builds the LLM router (semantic route embeddings cache, RouteLLM checkpoint) ahead of serving requests"
+
+    def handle(self, *args, **options):
+        timings = warmup()
+        for component, seconds in timings.items():
+            self.stdout.write(f"{component}: {seconds}s")
+        self.stdout.write(self.style.SUCCESS("LLM router ready"))
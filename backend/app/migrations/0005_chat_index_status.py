@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_alter_message_model_used'),
+    ]
+
+    operations = [
+        # chats created before background indexing already have their index built
+        migrations.AddField(
+            model_name='chat',
+            name='index_status',
+            field=models.CharField(choices=[('pending', 'PENDING'), ('ready', 'READY'), ('failed', 'FAILED')], default='ready', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='chat',
+            name='index_status',
+            field=models.CharField(choices=[('pending', 'PENDING'), ('ready', 'READY'), ('failed', 'FAILED')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='index_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
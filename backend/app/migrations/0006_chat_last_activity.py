@@ -0,0 +1,43 @@
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Substr
+
+
+def backfill_last_message(apps, schema_editor):
+    '''
+    Sets the last activity and message preview of existing chats from their latest message in one query
+    '''
+    Chat = apps.get_model('app', 'Chat')
+    Message = apps.get_model('app', 'Message')
+
+    last_message = Message.objects.filter(chat=OuterRef('pk')).order_by('-sent_at', '-id')
+    Chat.objects.update(
+        last_activity_at=Coalesce(Subquery(last_message.values('sent_at')[:1]), F('started_at')),
+        last_message_preview=Coalesce(Subquery(last_message.annotate(preview=Substr('content', 1, 50)).values('preview')[:1]), Value('')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_chat_index_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['-last_activity_at', '-id'], name='chat_last_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 5.0.14 on 2026-10-17 20:13
+
+import json
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+BATCH_SIZE = 500
+
+
+def move_payloads(apps, schema_editor):
+    '''
+    Moves the provider responses stored in AI messages' metadata to compressed payloads, filling the compact columns
+    '''
+    Message = apps.get_model('app', 'Message')
+    MessagePayload = apps.get_model('app', 'MessagePayload')
+
+    messages = Message.objects.filter(role='assistant', metadata__has_key='response').only('id', 'metadata')
+    batch = []
+    for message in messages.iterator(chunk_size=BATCH_SIZE):
+        response = message.metadata.pop('response')
+        usage = response.get('usage') or {}
+        message.routing_reason = ((response.get('routing_decision') or {}).get('based_on') or '')[:255]
+        message.prompt_tokens = usage.get('prompt_tokens')
+        message.completion_tokens = usage.get('completion_tokens')
+        batch.append((message, MessagePayload(message_id=message.id, compressed=zlib.compress(json.dumps(response, ensure_ascii=False).encode()))))
+
+        if len(batch) == BATCH_SIZE:
+            _save_batch(Message, MessagePayload, batch)
+            batch = []
+    _save_batch(Message, MessagePayload, batch)
+
+
+def _save_batch(Message, MessagePayload, batch):
+    Message.objects.bulk_update([message for message, _ in batch], ['metadata', 'routing_reason', 'prompt_tokens', 'completion_tokens'])
+    MessagePayload.objects.bulk_create([payload for _, payload in batch])
+
+
+def restore_payloads(apps, schema_editor):
+    Message = apps.get_model('app', 'Message')
+    MessagePayload = apps.get_model('app', 'MessagePayload')
+
+    for payload in MessagePayload.objects.iterator(chunk_size=BATCH_SIZE):
+        message = Message.objects.get(id=payload.message_id)
+        message.metadata['response'] = json.loads(zlib.decompress(payload.compressed))
+        message.save(update_fields=['metadata'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_chat_last_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessagePayload',
+            fields=[
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payload', serialize=False, to='app.message')),
+                ('compressed', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='completion_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='latency_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='prompt_tokens',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='routing_reason',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.RunPython(move_payloads, restore_payloads),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-17 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_message_payload'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'sent_at'], name='message_chat_sent_at_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-17 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_message_chat_sent_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='token_counts',
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_chat_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='pending_knowledgebase',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -1,20 +1,60 @@
 import json
 import random
-from typing import Optional
+import zlib
+from typing import List, Optional
 
 from django.db import models
-from app.enums import Role, LLMName
+from django.utils import timezone
+from app.enums import Role, LLMName, IndexStatus
+
+
+LAST_MESSAGE_PREVIEW_LENGTH = 50
+
+# message fields read for the chat history sent to the LLM
+HISTORY_FIELDS = ("id", "role", "content", "token_counts")
 
 
 class Chat(models.Model):
     name = models.CharField(max_length=255, blank=True, null=True)
     started_at = models.DateTimeField(auto_now_add=True)
+    index_status = models.CharField(max_length=20, choices=[(status.value, status.name) for status in IndexStatus], default=IndexStatus.PENDING.value)
+    index_error = models.TextField(blank=True, null=True)  # only for chats whose index failed to build
+    # kept until the chat's index is built, so that indexing interrupted by a restart is resumed (see `app.utils.index_jobs`)
+    pending_knowledgebase = models.TextField(blank=True, null=True)
+
+    # denormalized from the chat's latest message (kept up to date by `add_message`) so that the chat list is one query
+    last_activity_at = models.DateTimeField(default=timezone.now)  # when the latest message was sent, or the chat started
+    last_message_preview = models.CharField(max_length=LAST_MESSAGE_PREVIEW_LENGTH, blank=True, default="")
+
+    # rolling summary of the older messages, updated in the background by the weak model (see `app.utils.chat_summary`),
+    # the prompt gets it instead of those messages
+    summary = models.TextField(blank=True, default="")
+    summarized_until = models.DateTimeField(blank=True, null=True)  # sent_at of the latest message in the summary
+
+    class Meta:
+        indexes = [
+            # chat list, most recently active first (cursor pagination on last_activity_at, id)
+            models.Index(fields=["-last_activity_at", "-id"], name="chat_last_activity_idx"),
+        ]
     
     def __str__(self):
         return f"Chat {self.id} - {self.name if self.name else 'Untitled'}"
 
+    def _set_last_message(self, message: "Message") -> dict:
+        '''
+        Updates the denormalized last message fields of this instance and returns them (to save them)
+        '''
+        self.last_activity_at = message.sent_at
+        self.last_message_preview = message.content[:LAST_MESSAGE_PREVIEW_LENGTH]
+        return {"last_activity_at": self.last_activity_at, "last_message_preview": self.last_message_preview}
+
     def add_message(self, content: str, role: str, model_used: Optional[str] = None,
-                    predicted_semantic: Optional[str] = None, metadata: Optional[dict] = None):
+                    predicted_semantic: Optional[str] = None, metadata: Optional[dict] = None,
+                    payload: Optional[dict] = None, **fields):
+        '''
+        Adds a message to the chat. `payload` is the raw provider response (stored compressed, apart from the message),
+        `fields` are the other `Message` columns (routing reason, token counts, latency)
+        '''
         message = Message.objects.create(
             content=content,
             role=role,
@@ -22,14 +62,46 @@ class Chat(models.Model):
             predicted_semantic=predicted_semantic,
             chat=self,
             metadata=metadata or {},
+            **fields,
+        )
+        if payload is not None:
+            MessagePayload.objects.create(message=message, compressed=MessagePayload.compress(payload))
+        Chat.objects.filter(pk=self.pk).update(**self._set_last_message(message))
+        return message
+    
+    async def aadd_message(self, content: str, role: str, model_used: Optional[str] = None,
+                           predicted_semantic: Optional[str] = None, metadata: Optional[dict] = None,
+                           payload: Optional[dict] = None, **fields):
+        message = await Message.objects.acreate(
+            content=content,
+            role=role,
+            model_used=model_used,
+            predicted_semantic=predicted_semantic,
+            chat=self,
+            metadata=metadata or {},
+            **fields,
         )
+        if payload is not None:
+            await MessagePayload.objects.acreate(message=message, compressed=MessagePayload.compress(payload))
+        await Chat.objects.filter(pk=self.pk).aupdate(**self._set_last_message(message))
         return message
     
-    def get_messages(self, k_recent: Optional[int] = None):
-        if k_recent is not None:
-            return self.messages.order_by("-sent_at")[:k_recent][::-1]
-        else:
-            return self.messages.all().order_by("sent_at")
+    def _get_history_query(self, k_recent: int, after_summary: bool):
+        messages = self.messages.all()
+        if after_summary and self.summarized_until is not None:
+            messages = messages.filter(sent_at__gt=self.summarized_until)
+        return messages.order_by("-sent_at").values(*HISTORY_FIELDS)[:k_recent]
+
+    def get_history(self, k_recent: int, after_summary: bool = False) -> List[dict]:
+        '''
+        The `k_recent` latest messages (oldest first) for the LLM prompt, only their role, content and token counts
+        are read, straight from the (chat, sent_at) index however long the chat is.
+        With `after_summary`, only the messages not in the chat's summary yet.
+        '''
+        return list(self._get_history_query(k_recent, after_summary))[::-1]
+
+    async def aget_history(self, k_recent: int, after_summary: bool = False) -> List[dict]:
+        return [message async for message in self._get_history_query(k_recent, after_summary)][::-1]
 
     
 class Message(models.Model):
@@ -39,7 +111,20 @@ class Message(models.Model):
     model_used = models.CharField(max_length=255, choices=[(model.value, model.name) for model in LLMName], blank=True, null=True)  # only for AI messages
     predicted_semantic = models.CharField(max_length=50, blank=True, null=True)  # only for user messages where semantic was predicted
     chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name="messages")
-    metadata = models.JSONField(default=dict)  
+    metadata = models.JSONField(default=dict)  # small extras (routing decision of user messages, response cache hits)
+
+    # only for AI messages, the raw provider response is in `payload`
+    routing_reason = models.CharField(max_length=255, blank=True, null=True)
+    prompt_tokens = models.PositiveIntegerField(blank=True, null=True)
+    completion_tokens = models.PositiveIntegerField(blank=True, null=True)
+    latency_ms = models.PositiveIntegerField(blank=True, null=True)  # from the query to the complete response, routing included
+    token_counts = models.JSONField(default=dict)  # tokens of the content per model name, filled as needed for prompt packing
+
+    class Meta:
+        indexes = [
+            # recent history of a chat (see `Chat.get_history`)
+            models.Index(fields=["chat", "sent_at"], name="message_chat_sent_at_idx"),
+        ]
 
     def __str__(self):
         return json.dumps({
@@ -49,8 +134,8 @@ class Message(models.Model):
             ensure_ascii=False,
         )
     
-    def serialize(self):
-        return {
+    def serialize(self, include_metadata: bool = True):
+        message = {
             "id": self.id,
             "chat_id": self.chat_id,
             "role": self.role,
@@ -58,9 +143,34 @@ class Message(models.Model):
             "sent_at": self.sent_at.isoformat(),
             "model_used": self.model_used,
             "predicted_semantic": self.predicted_semantic,
-            "metadata": self.metadata,
+            "routing_reason": self.routing_reason,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "latency_ms": self.latency_ms,
         }
+        # metadata (eg the raw provider response) is much larger than the rest, it can be left out and fetched on demand
+        if include_metadata:
+            message["metadata"] = self.metadata
+        return message
     
+
+class MessagePayload(models.Model):
+    '''
+    Raw provider response of an AI message, zlib-compressed JSON kept out of the message table so that reading
+    messages (eg the chat history sent to the LLM) does not load it
+    '''
+    message = models.OneToOneField(Message, on_delete=models.CASCADE, primary_key=True, related_name="payload")
+    compressed = models.BinaryField()
+
+    @staticmethod
+    def compress(payload: dict) -> bytes:
+        return zlib.compress(json.dumps(payload, ensure_ascii=False, default=str).encode())
+
+    @property
+    def data(self) -> dict:
+        return json.loads(zlib.decompress(self.compressed))
+
+
 # class LLM(models.Model):
 #     name = models.CharField(max_length=255, choices=[(model.value, model.name) for model in LLMName], primary_key=True)
 
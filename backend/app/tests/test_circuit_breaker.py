@@ -0,0 +1,319 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from app.enums import CircuitState, LLMName, LLMType, OptimizationMetric
+from app.utils.circuit_breaker import CircuitBreaker, CircuitBreakers, CircuitOpenError
+from app.utils.llmrouter import LLMRouter, RoutingDecision
+from app.utils.telemetry import Telemetry
+
+
+class Clock:
+    '''
+    Stand-in for `time.monotonic`, moved forward by the tests
+    '''
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("app.utils.circuit_breaker.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, error_rate_threshold=0.5, window=4, open_duration=30)
+
+    def open_circuit(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+    def test_opens_after_failure_threshold(self):
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+        self.assertTrue(self.breaker.allow_request())
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitState.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+
+    def test_success_resets_consecutive_failures(self):
+        self.breaker = CircuitBreaker(failure_threshold=3)
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+
+    def test_opens_on_error_rate(self):
+        self.breaker.failure_threshold = 10
+        for outcome in ("failure", "success", "failure"):
+            getattr(self.breaker, f"record_{outcome}")()
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)  # window not full yet
+
+        self.breaker.record_success()
+        self.breaker.record_failure()  # 2 failures in the last 4 requests
+        self.assertEqual(self.breaker.state, CircuitState.OPEN)
+
+    def test_half_open_lets_one_probe_through(self):
+        self.open_circuit()
+        self.clock.now += 29
+        self.assertFalse(self.breaker.allow_request())
+
+        self.clock.now += 1
+        self.assertTrue(self.breaker.allow_request())
+        self.assertEqual(self.breaker.state, CircuitState.HALF_OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+
+        # a probe that never reported back does not block the circuit forever
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_closes_on_probe_success(self):
+        self.open_circuit()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow_request())
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertTrue(self.breaker.allow_request())
+        self.assertEqual(self.breaker.error_rate, 0)
+
+    def test_reopens_on_probe_failure(self):
+        self.open_circuit()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow_request())
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitState.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(self.breaker.to_dict()["retry_in"], 30)
+
+
+class Usage:
+    completion_tokens = 3
+
+
+class Response(dict):
+    '''
+    Minimal litellm `ModelResponse`: the model that answered, its usage and the hidden params
+    '''
+
+    def __init__(self, model: str):
+        super().__init__(_hidden_params={})
+        self.model = model
+        self.usage = Usage()
+
+
+class Stream:
+    '''
+    Minimal litellm stream of `model`, iterable both ways, that records whether it was closed
+    '''
+
+    def __init__(self, model: str):
+        self.model = model
+        self.chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))]) for content in ("Hello", " world")]
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+    async def aclose(self):
+        self.closed = True
+
+
+class LLMRouterAvailabilityTests(SimpleTestCase):
+    '''
+    Fallback to the other model (open circuit, failure) and hedging, with the litellm calls replaced by
+    `fake_completion` and `fake_acompletion` whose behaviour per model is set in `self.behaviours`
+    '''
+
+    def setUp(self):
+        self.breakers = CircuitBreakers(failure_threshold=2, open_duration=30)
+        for target, value in (("circuit_breakers", self.breakers), ("telemetry", Telemetry()), ("completion", self.fake_completion),
+                              ("acompletion", self.fake_acompletion)):
+            patcher = mock.patch(f"app.utils.llmrouter.{target}", value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.router = LLMRouter(LLMName.GPT_4_O, LLMName.LLAMA3_8B, hedge_delay=0.05)
+        self.strong, self.weak = self.router.models["strong"], self.router.models["weak"]
+        self.behaviours = {}
+        self.calls, self.cancelled, self.streams = [], [], {}
+
+    def tearDown(self):
+        self.router._hedge_executor.shutdown()
+
+    def fake_completion(self, **kwargs):
+        model = kwargs["model"]
+        self.calls.append(model)
+        if self.behaviours.get(model, "answer") == "late":
+            time.sleep(0.2)
+        self.streams[model] = Stream(model)
+        return self.streams[model]
+
+    async def fake_acompletion(self, **kwargs):
+        model = kwargs["model"]
+        self.calls.append(model)
+        behaviour = self.behaviours.get(model, "answer")
+        try:
+            if behaviour == "fail":
+                raise RuntimeError(f"{model} failed")
+            if behaviour == "late":
+                await asyncio.sleep(0.2)
+            if behaviour == "slow":
+                await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        if kwargs.get("stream"):
+            self.streams[model] = Stream(model)
+            return self.streams[model]
+        return Response(model)
+
+    def routing_decision(self, model_type: LLMType = LLMType.STRONG) -> dict:
+        return {
+            "query": "Hi",
+            "predicted_semantic": None,
+            "model": self.router.models[model_type].name,
+            "model_type": model_type,
+            "optimization_metric": None,
+            "based_on": "Difficulty",
+        }
+
+    def open_circuit(self, model_name: str):
+        for _ in range(2):
+            self.breakers.record_failure(model_name)
+
+    def test_select_available_model(self):
+        routing_decision = self.routing_decision()
+        self.assertIs(self.router._select_available_model(routing_decision, self.router.models), self.strong)
+        self.assertEqual(routing_decision["model"], self.strong.name)
+
+    def test_select_available_model_routes_to_fallback_while_circuit_open(self):
+        self.open_circuit(self.strong.name)
+
+        routing_decision = self.routing_decision()
+        self.assertIs(self.router._select_available_model(routing_decision, self.router.models), self.weak)
+        self.assertEqual(routing_decision["model"], self.weak.name)
+        self.assertEqual(routing_decision["model_type"], LLMType.WEAK)
+        self.assertIn("circuit open", routing_decision["based_on"])
+
+    def test_select_available_model_with_both_circuits_open(self):
+        self.open_circuit(self.strong.name)
+        self.open_circuit(self.weak.name)
+
+        with self.assertRaises(CircuitOpenError):
+            self.router._select_available_model(self.routing_decision(), self.router.models)
+
+    async def test_completion_skips_model_with_open_circuit(self):
+        self.open_circuit(self.strong.name)
+
+        response = await self.router.acompletion(messages=[{"role": "user", "content": "Hi"}], routing_decision=self.routing_decision())
+
+        self.assertEqual(self.calls, [self.weak.model])
+        self.assertEqual(response["_hidden_params"]["routing_decision"]["model"], self.weak.name)
+
+    async def test_completion_falls_back_on_failure(self):
+        self.router.hedge_delay = None
+        self.behaviours[self.strong.model] = "fail"
+
+        response = await self.router.acompletion(messages=[{"role": "user", "content": "Hi"}], routing_decision=self.routing_decision(),
+                                                 optimization_metric=OptimizationMetric.AVAILABILITY)
+
+        self.assertEqual(self.calls, [self.strong.model, self.weak.model])
+        self.assertEqual(response.model, self.weak.model)
+        self.assertIn("failed", response["_hidden_params"]["routing_decision"]["based_on"])
+
+    async def test_completion_failure_opens_circuit(self):
+        self.behaviours[self.strong.model] = "fail"
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                await self.router.acompletion(messages=[{"role": "user", "content": "Hi"}], routing_decision=self.routing_decision())
+
+        self.assertEqual(self.breakers.snapshot()[self.strong.name]["state"], CircuitState.OPEN)
+
+    async def test_hedge_not_sent_when_preferred_model_answers_in_time(self):
+        response = await self.router.acompletion(messages=[{"role": "user", "content": "Hi"}], routing_decision=self.routing_decision(),
+                                                 optimization_metric=OptimizationMetric.AVAILABILITY)
+
+        routing_decision = response["_hidden_params"]["routing_decision"]
+        self.assertEqual(self.calls, [self.strong.model])
+        self.assertIsNone(routing_decision["hedge_winner"])
+        self.assertEqual(routing_decision["model"], self.strong.name)
+
+    async def test_hedge_winner_recorded_and_loser_cancelled(self):
+        self.behaviours[self.strong.model] = "slow"
+
+        response = await self.router.acompletion(messages=[{"role": "user", "content": "Hi"}], routing_decision=self.routing_decision(),
+                                                 optimization_metric=OptimizationMetric.AVAILABILITY)
+        await asyncio.sleep(0)  # let the cancellation reach the losing request
+
+        routing_decision = response["_hidden_params"]["routing_decision"]
+        self.assertEqual(response.model, self.weak.model)
+        self.assertEqual(routing_decision["hedge_winner"], "hedge")
+        self.assertEqual(routing_decision["model"], self.weak.name)
+        self.assertEqual(routing_decision["model_type"], LLMType.WEAK)
+        self.assertEqual(self.cancelled, [self.strong.model])
+        self.assertEqual(routing_decision["hedge_reason"], "no answer from preferred model after 0.05s")
+
+    async def test_hedge_reason_when_preferred_model_fails(self):
+        self.behaviours[self.strong.model] = "fail"
+        self.router.hedge_delay = 5
+
+        response = await self.router.acompletion(messages=[{"role": "user", "content": "Hi"}], routing_decision=self.routing_decision(),
+                                                 optimization_metric=OptimizationMetric.AVAILABILITY)
+
+        routing_decision = response["_hidden_params"]["routing_decision"]
+        self.assertEqual(routing_decision["hedge_winner"], "hedge")
+        self.assertEqual(routing_decision["hedge_reason"], "preferred model failed: RuntimeError")
+        self.assertIn("preferred model failed", routing_decision["based_on"])
+        self.assertEqual(RoutingDecision.from_dict(routing_decision).to_dict()["hedge_reason"], routing_decision["hedge_reason"])
+
+    async def test_hedge_preferred_model_wins(self):
+        self.behaviours.update({self.strong.model: "late", self.weak.model: "slow"})
+
+        response = await self.router.acompletion(messages=[{"role": "user", "content": "Hi"}], routing_decision=self.routing_decision(),
+                                                 optimization_metric=OptimizationMetric.AVAILABILITY)
+        await asyncio.sleep(0)
+
+        routing_decision = response["_hidden_params"]["routing_decision"]
+        self.assertEqual(routing_decision["hedge_winner"], "preferred")
+        self.assertEqual(routing_decision["model"], self.strong.name)
+        self.assertEqual(self.cancelled, [self.weak.model])
+
+    def test_hedge_loser_stream_closed(self):
+        self.behaviours[self.strong.model] = "late"
+
+        routing_decision, stream = self.router.stream_completion(messages=[{"role": "user", "content": "Hi"}], routing_decision=self.routing_decision(),
+                                                                 optimization_metric=OptimizationMetric.AVAILABILITY)
+        self.router._hedge_executor.shutdown()  # let the losing request finish
+
+        self.assertEqual(routing_decision["hedge_winner"], "hedge")
+        self.assertEqual([chunk.choices[0].delta.content for chunk in stream], ["Hello", " world"])
+        self.assertTrue(self.streams[self.strong.model].closed)
+
+    async def test_unread_first_response_stream_closed(self):
+        # the losing stream of a hedged request has only had its first chunk read when it is closed
+        stream = await self.router._afirst_response(self.strong, {"messages": [{"role": "user", "content": "Hi"}], "stream": True})
+        await stream.aclose()
+
+        self.assertTrue(self.streams[self.strong.model].closed)
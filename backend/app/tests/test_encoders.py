@@ -0,0 +1,87 @@
+import copy
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from app.constants import SEMANTIC_ROUTES
+from app.utils.encoders import HashingNGramEncoder, get_semantic_router_encoder
+from app.utils.route_embeddings import build_semantic_route_layer
+
+
+class HashingNGramEncoderTests(SimpleTestCase):
+    '''
+    Calibration of `HashingNGramEncoder.score_threshold` on the semantic routes, offline: paraphrases of the route
+    utterances are at least 0.50 similar to their nearest utterance, unrelated (knowledgebase) queries at most 0.30.
+    Character n-grams measure surface overlap rather than meaning, a query sharing a phrase with an utterance
+    (eg "Can you tell me about ...") can still match its route.
+    '''
+
+    PARAPHRASES = {
+        "greeting": ["Hi there", "hello!", "hey there", "Hola amigo", "Bonjour à tous", "Salam alaikum", "Ciao bella"],
+        "urdu": ["Kya coding seekhna asaan hai?", "میں نے اس کو کل دیکھا", "کتابوں کا مطالعہ بہت ضروری ہے۔"],
+        "arabic": ["ما هي سياسة الموارد البشرية؟", "هل تعلم البرمجة سهل؟", "كان الطقس جميلا اليوم"],
+        "multi_lingual": ["kya programming seekhna easy hai?", "¿Dónde está el supermercado?", "我想知道 'rain' 的中文是什么?"],
+    }
+
+    UNRELATED = [
+        "What is the refund policy of the company?",
+        "Summarize the quarterly sales report",
+        "How many employees work in the Berlin office?",
+        "Explain the difference between TCP and UDP",
+        "What are the opening hours?",
+        "Write a python function that sorts a list",
+        "Who is the CEO?",
+        "List the key points of the document",
+        "What does the contract say about termination?",
+        "How do I reset my password?",
+        "What is the notice period for resignation?",
+        "What is the capital of France?",
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cache_dir = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cache_dir.cleanup)
+
+        cls.encoder = HashingNGramEncoder()
+        # building the layer sets the routes' thresholds, keep the shared routes untouched
+        cls.routes = copy.deepcopy(SEMANTIC_ROUTES)
+        cls.layer = build_semantic_route_layer(cls.encoder, cls.routes, cache_dir.name)
+        cls.utterance_vectors = np.asarray(cls.encoder([utterance for route in cls.routes for utterance in route.utterances]))
+
+    def nearest_utterance_similarity(self, query: str) -> float:
+        return float(np.max(self.utterance_vectors @ np.asarray(self.encoder([query])[0])))
+
+    def test_utterances_match_their_route(self):
+        for route in self.routes:
+            # an utterance also in another route (up to case) can match either
+            others = {utterance.casefold() for other in self.routes if other is not route for utterance in other.utterances}
+            for utterance in route.utterances:
+                if utterance.casefold() not in others:
+                    with self.subTest(utterance=utterance):
+                        self.assertEqual(self.layer(utterance).name, route.name)
+
+    def test_paraphrases_match_their_route(self):
+        for route_name, queries in self.PARAPHRASES.items():
+            for query in queries:
+                with self.subTest(query=query):
+                    self.assertEqual(self.layer(query).name, route_name)
+
+    def test_unrelated_queries_match_no_route(self):
+        for query in self.UNRELATED:
+            with self.subTest(query=query):
+                self.assertIsNone(self.layer(query).name)
+
+    def test_threshold_between_unrelated_queries_and_paraphrases(self):
+        paraphrases = [query for queries in self.PARAPHRASES.values() for query in queries]
+        lowest_paraphrase = min(self.nearest_utterance_similarity(query) for query in paraphrases)
+        highest_unrelated = max(self.nearest_utterance_similarity(query) for query in self.UNRELATED)
+
+        self.assertLess(highest_unrelated, self.encoder.score_threshold)
+        self.assertGreater(lowest_paraphrase, self.encoder.score_threshold)
+
+    def test_configured_score_threshold(self):
+        self.assertEqual(get_semantic_router_encoder("hashing").score_threshold, self.encoder.score_threshold)
+        self.assertEqual(get_semantic_router_encoder("hashing", score_threshold=0.5).score_threshold, 0.5)
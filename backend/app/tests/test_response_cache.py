@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from langchain_core.documents import Document
+
+from app.enums import IndexStatus
+from app.models import Chat
+from app.utils import chat as chat_utils
+from app.utils.response_cache import ResponseCache
+
+
+class Response(dict):
+    '''
+    Minimal litellm `ModelResponse` of a completion answering `content`
+    '''
+
+    def __init__(self, content: str):
+        super().__init__(_hidden_params={"routing_decision": {"model": "weak", "based_on": "Difficulty", "predicted_semantic": None}})
+        self.model = "weak"
+        self.choices = [SimpleNamespace(message=SimpleNamespace(content=content))]
+        self.usage = SimpleNamespace(prompt_tokens=10, completion_tokens=5)
+
+    def json(self) -> dict:
+        return {"content": self.choices[0].message.content}
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class ResponseCacheTests(TestCase):
+    '''
+    AI responses of a chat answered from the response cache, with retrieval, query embeddings and the LLM replaced by
+    stand-ins: both refund queries retrieve the refund policy and embed to nearly the same vector
+    '''
+
+    VECTORS = {
+        "What is the refund policy?": [1.0, 0.0, 0.0],
+        "Can you tell me the refund policy?": [0.99, 0.1, 0.0],
+        "Who founded the company?": [0.0, 1.0, 0.0],
+    }
+
+    def setUp(self):
+        self.chat = Chat.objects.create(index_status=IndexStatus.READY.value)
+        self.completions = []
+        index = SimpleNamespace(embedding_function=SimpleNamespace(model="embeddings", embed_query=self.VECTORS.__getitem__))
+        llm_router = SimpleNamespace(acompletion=self.fake_acompletion)
+        for target, value in (("response_cache", ResponseCache(max_entries=8, ttl=60, similarity_threshold=0.95)),
+                              ("retrieve_context", self.fake_retrieve_context), ("load_index", lambda chat_id: index),
+                              ("_aroute_and_build_messages", self.fake_route_and_build_messages),
+                              ("get_llm_router", lambda: llm_router), ("submit_summary_job", lambda chat_id, llm_router: None)):
+            patcher = mock.patch.object(chat_utils, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def fake_retrieve_context(chat_id, query_embeddings, search_params=None):
+        content = "Refunds within 30 days." if "refund" in query_embeddings.query else "Founded by Ada in 1990."
+        return [(Document(page_content=content), 0.1)]
+
+    @staticmethod
+    async def fake_route_and_build_messages(query, chat, user_message, docs_and_scores, history, optimization_metric, query_embeddings):
+        return {"messages": [{"role": "user", "content": query}]}, {"weak": {}}
+
+    async def fake_acompletion(self, optimization_metric, query_embeddings, **kwargs):
+        self.completions.append(query_embeddings.query)
+        return Response(f"Answer to: {query_embeddings.query}")
+
+    async def test_paraphrase_on_later_turn_hits_cache(self):
+        await chat_utils.aget_ai_response("What is the refund policy?", self.chat.id)
+        await chat_utils.aget_ai_response("Who founded the company?", self.chat.id)
+        # the conversation has moved on, the retrieved context is the same
+        ai_message = (await chat_utils.aget_ai_response("Can you tell me the refund policy?", self.chat.id))["ai_message"]
+
+        self.assertEqual(self.completions, ["What is the refund policy?", "Who founded the company?"])
+        self.assertTrue(ai_message["metadata"]["response_cache"]["hit"])
+        self.assertEqual(ai_message["metadata"]["response_cache"]["cached_query"], "What is the refund policy?")
+        self.assertEqual(ai_message["content"], "Answer to: What is the refund policy?")
+
+    async def test_different_context_misses_cache(self):
+        await chat_utils.aget_ai_response("What is the refund policy?", self.chat.id)
+        ai_message = (await chat_utils.aget_ai_response("Who founded the company?", self.chat.id))["ai_message"]
+
+        self.assertEqual(len(self.completions), 2)
+        self.assertNotIn("response_cache", ai_message["metadata"])
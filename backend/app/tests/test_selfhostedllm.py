@@ -0,0 +1,153 @@
+import asyncio
+import json
+import threading
+
+import aiohttp
+from aiohttp import web
+from django.test import SimpleTestCase
+
+from app.utils.selfhostedllm import LLMWrapper, SelfHostedLLMInferenceClient
+
+
+class StubOllamaServer:
+    '''
+    Local stand-in for ollama's `/api/chat`, run on its own event loop thread. The model name picks the behaviour:
+    "slow" answers after `SLOW_DELAY` seconds, "error" fails with a 500, any other model answers "Hello world"
+    (in two chunks when streaming). The received requests are kept in `requests`.
+    '''
+
+    SLOW_DELAY = 1.0
+
+    def __init__(self):
+        self.requests = []
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    async def _chat(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.requests.append({"headers": dict(request.headers), "payload": payload})
+
+        if payload["model"] == "error":
+            return web.json_response({"error": "model crashed"}, status=500)
+        if payload["model"] == "slow":
+            await asyncio.sleep(self.SLOW_DELAY)
+
+        if not payload["stream"]:
+            return web.json_response({"model": payload["model"], "message": {"role": "assistant", "content": "Hello world"}, "done": True})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        for content, done in (("Hello", False), (" world", False), ("", True)):
+            await response.write(json.dumps({"message": {"role": "assistant", "content": content}, "done": done}).encode() + b"\n")
+        await response.write_eof()
+        return response
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_post("/api/chat", self._chat)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    def start(self) -> str:
+        self._thread.start()
+        port = asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return f"http://127.0.0.1:{port}/"
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class SelfHostedLLMInferenceClientTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = StubOllamaServer()
+        cls.base_url = cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests.clear()
+        self.client = SelfHostedLLMInferenceClient(self.base_url, api_key="secret", read_timeout=StubOllamaServer.SLOW_DELAY / 4)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_chat(self):
+        response = self.client.chat([{"role": "user", "content": "Hi"}], "llama3", temperature=0.2, stop=["\n"])
+
+        self.assertEqual(response["message"]["content"], "Hello world")
+        request = self.server.requests[0]
+        self.assertEqual(request["payload"], {
+            "model": "llama3",
+            "messages": [{"role": "user", "content": "Hi"}],
+            "options": {"temperature": 0.2, "stop": ["\n"]},
+            "stream": False,
+        })
+        self.assertEqual(request["headers"]["Authorization"], "Bearer secret")
+
+    def test_achat(self):
+        response = asyncio.run(self.client.achat([{"role": "user", "content": "Hi"}], "llama3"))
+        self.assertEqual(response["message"]["content"], "Hello world")
+
+    def test_stream_chat(self):
+        chunks = list(self.client.stream_chat([{"role": "user", "content": "Hi"}], "llama3"))
+
+        self.assertEqual([chunk["message"]["content"] for chunk in chunks], ["Hello", " world", ""])
+        self.assertTrue(chunks[-1]["done"])
+        self.assertTrue(self.server.requests[0]["payload"]["stream"])
+
+    def test_astream_chat(self):
+        async def collect():
+            return [chunk async for chunk in self.client.astream_chat([{"role": "user", "content": "Hi"}], "llama3")]
+
+        chunks = asyncio.run(collect())
+        self.assertEqual("".join(chunk["message"]["content"] for chunk in chunks), "Hello world")
+
+    def test_stream_chat_stopped_early(self):
+        # the connection goes back to the pool and the next request reuses the session
+        chunks = self.client.stream_chat([{"role": "user", "content": "Hi"}], "llama3")
+        self.assertEqual(next(chunks)["message"]["content"], "Hello")
+        chunks.close()
+
+        response = self.client.chat([{"role": "user", "content": "Hi"}], "llama3")
+        self.assertEqual(response["message"]["content"], "Hello world")
+
+    def test_server_error(self):
+        with self.assertRaises(aiohttp.ClientResponseError) as context:
+            self.client.chat([{"role": "user", "content": "Hi"}], "error")
+        self.assertEqual(context.exception.status, 500)
+
+        with self.assertRaises(aiohttp.ClientResponseError):
+            list(self.client.stream_chat([{"role": "user", "content": "Hi"}], "error"))
+
+    def test_read_timeout(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            self.client.chat([{"role": "user", "content": "Hi"}], "slow")
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(self.client.achat([{"role": "user", "content": "Hi"}], "slow"))
+
+    def test_connect_error(self):
+        client = SelfHostedLLMInferenceClient("http://127.0.0.1:1", connect_timeout=1)
+        try:
+            with self.assertRaises(aiohttp.ClientConnectionError):
+                client.chat([{"role": "user", "content": "Hi"}], "llama3")
+        finally:
+            client.close()
+
+    def test_llm_wrapper(self):
+        llm = LLMWrapper(inference_client=self.client, model_name="llama3")
+
+        self.assertEqual(llm.invoke("Hi"), "Hello world")
+        self.assertEqual("".join(llm.stream("Hi")), "Hello world")
+        self.assertEqual(self.server.requests[0]["payload"]["messages"], [{"role": "user", "content": "Hi"}])
@@ -0,0 +1,68 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from app.enums import LLMName, LLMType, OptimizationMetric
+from app.utils.llmrouter import LLMRouter
+from app.utils.telemetry import ModelTelemetry, Telemetry
+
+
+class ModelTelemetryTests(SimpleTestCase):
+
+    def test_streamed_and_non_streamed_throughputs_are_kept_apart(self):
+        model = ModelTelemetry()
+        model.record_success(latency=2.0, ttft=1.0, completion_tokens=100)
+        model.record_success(latency=4.0, completion_tokens=100)
+
+        self.assertEqual(model.tokens_per_second.value, 100)
+        self.assertEqual(model.end_to_end_tokens_per_second.value, 25)
+
+    def test_expected_latency(self):
+        model = ModelTelemetry()
+        self.assertIsNone(model.expected_latency)
+
+        model.record_success(latency=3.0, ttft=1.0, completion_tokens=100)
+        self.assertEqual(model.expected_latency, 3.0)
+
+    def test_expected_latency_without_streaming(self):
+        model = ModelTelemetry()
+        model.record_success(latency=4.0, completion_tokens=100)
+        self.assertEqual(model.expected_latency, 4.0)
+
+    def test_expected_latency_grows_with_errors(self):
+        model = ModelTelemetry()
+        model.record_success(latency=3.0, ttft=1.0, completion_tokens=100)
+        model.record_error()
+
+        self.assertAlmostEqual(model.expected_latency, 3.0 / 0.9)
+
+
+class LatencyRoutingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.telemetry = Telemetry()
+        patcher = mock.patch("app.utils.llms.telemetry", self.telemetry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = LLMRouter(LLMName.GPT_4_O, LLMName.LLAMA3_8B)
+        self.strong, self.weak = self.router.models["strong"], self.router.models["weak"]
+
+    def route(self) -> dict:
+        return self.router._route_based_on_optimization_metric("Hi", OptimizationMetric.LATENCY, self.router.models)
+
+    def test_unmeasured_model_first(self):
+        self.assertEqual(self.route()["model_type"], LLMType.WEAK)
+
+        self.telemetry.record_success(self.weak.name, latency=1.0, ttft=0.5, completion_tokens=50)
+        self.assertEqual(self.route()["model_type"], LLMType.STRONG)
+
+    def test_lower_expected_latency_wins(self):
+        # the weak model generates faster but takes long to start
+        self.telemetry.record_success(self.strong.name, latency=2.0, ttft=0.2, completion_tokens=90)
+        self.telemetry.record_success(self.weak.name, latency=2.5, ttft=2.0, completion_tokens=100)
+        self.assertEqual(self.route()["model_type"], LLMType.STRONG)
+
+        # until its time to first token is outweighed by the strong model's errors
+        for _ in range(10):
+            self.telemetry.record_error(self.strong.name)
+        self.assertEqual(self.route()["model_type"], LLMType.WEAK)
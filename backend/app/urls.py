@@ -3,10 +3,20 @@ from . import views
 
 urlpatterns = [
     path('example/', views.example_view, name='example_view'),
+    path('warmup/', views.warmup_view, name='warmup'),
     path('all_models/', views.all_models, name='all_models'),
     path('models_info/', views.models_info, name='models_info'),
+    path('route_queries/', views.route_queries, name='route_queries'),
+    path('telemetry/', views.model_telemetry, name='model_telemetry'),
+    path('health/', views.health, name='health'),
+    path('index_cache/', views.index_cache_stats, name='index_cache_stats'),
     path('chat/<int:chat_id>/', views.get_chat, name='get_chat'),
+    path('chat/<int:chat_id>/messages/<int:message_id>/metadata/', views.message_metadata, name='message_metadata'),
+    path('chat/<int:chat_id>/export/', views.export_chat, name='export_chat'),
+    path('chat/<int:chat_id>/index_status/', views.index_status, name='index_status'),
+    path('chat/<int:chat_id>/knowledgebase/', views.knowledgebase, name='knowledgebase'),
     path('chats/', views.get_chats, name='get_chats'),
     path('create_chat/', views.create_chat, name='create_chat'),
     path('chat/<int:chat_id>/get_ai_response/', views.ai_response, name='get_ai_response'),
+    path('chat/<int:chat_id>/stream_ai_response/', views.ai_response_stream, name='stream_ai_response'),
 ]
\ No newline at end of file
@@ -0,0 +1,241 @@
+import math
+import statistics
+import time
+from typing import Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from django.conf import settings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.constants import (
+    HNSW_M, HNSW_EF_CONSTRUCTION, IVF_PQ_DIMENSIONS_PER_SUBQUANTIZER, IVF_PQ_BITS, IVF_PQ_REFINE_K_FACTOR, IVF_TRAINING_POINTS_PER_LIST,
+    INDEX_REPORT_QUERIES, INDEX_REPORT_NPROBES, INDEX_REPORT_EF_SEARCHES,
+)
+from app.enums import IndexType
+
+
+def choose_index_type(n_vectors: int) -> IndexType:
+    '''
+    Exact search for small knowledgebases, HNSW (fast, all vectors in memory) for medium ones and IVF-PQ
+    (compressed vectors, a fraction of the memory) for large ones
+    '''
+    if n_vectors <= settings.FLAT_INDEX_MAX_VECTORS:
+        return IndexType.FLAT
+    if n_vectors <= settings.HNSW_INDEX_MAX_VECTORS:
+        return IndexType.HNSW
+    return IndexType.IVF_PQ
+
+
+def get_index_type(index: faiss.Index) -> IndexType:
+    if isinstance(index, faiss.IndexHNSW):
+        return IndexType.HNSW
+    if isinstance(index, faiss.IndexRefine):
+        return IndexType.IVF_PQ
+    return IndexType.FLAT
+
+
+def _get_ivf_index(index: faiss.IndexRefine) -> faiss.IndexIVFPQ:
+    return faiss.downcast_index(index.base_index)
+
+
+def _ivf_pq_shape(n_vectors: int, dimensions: int) -> Tuple[int, int]:
+    '''
+    Number of inverted lists (about 4 * sqrt(n), with enough training points per list) and of PQ sub-quantizers
+    (a divisor of the dimensions)
+    '''
+    n_lists = max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // IVF_TRAINING_POINTS_PER_LIST))
+    n_subquantizers = max(1, dimensions // IVF_PQ_DIMENSIONS_PER_SUBQUANTIZER)
+    while dimensions % n_subquantizers:
+        n_subquantizers -= 1
+    return n_lists, n_subquantizers
+
+
+def new_faiss_index(index_type: IndexType, vectors: np.ndarray) -> faiss.Index:
+    '''
+    Creates an empty index of the given type for `vectors`, trained on (a sample of) them if the type needs it
+    '''
+    n_vectors, dimensions = vectors.shape
+
+    if index_type == IndexType.HNSW:
+        index = faiss.IndexHNSWFlat(dimensions, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = settings.INDEX_EF_SEARCH
+        return index
+
+    if index_type == IndexType.IVF_PQ:
+        # the PQ codes shortlist IVF_PQ_REFINE_K_FACTOR * k candidates, re-ranked with 8-bit quantized vectors
+        # (a quarter of the memory of the full vectors) as PQ distances alone are too coarse to rank them
+        n_lists, n_subquantizers = _ivf_pq_shape(n_vectors, dimensions)
+        ivf_index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dimensions), dimensions, n_lists, n_subquantizers, IVF_PQ_BITS)
+        ivf_index.nprobe = settings.INDEX_NPROBE
+        index = faiss.IndexRefine(ivf_index, faiss.IndexScalarQuantizer(dimensions, faiss.ScalarQuantizer.QT_8bit))
+        index.k_factor = IVF_PQ_REFINE_K_FACTOR
+
+        training_size = min(n_vectors, n_lists * IVF_TRAINING_POINTS_PER_LIST)
+        sample = np.random.default_rng(0).choice(n_vectors, size=training_size, replace=False)
+        index.train(vectors[np.sort(sample)])
+        return index
+
+    return faiss.IndexFlatL2(dimensions)
+
+
+def build_vector_store(
+    texts: List[str],
+    vectors: List[List[float]],
+    embeddings: Embeddings,
+    metadatas: Optional[List[dict]] = None,
+    ids: Optional[List[str]] = None,
+    index: Optional[faiss.Index] = None,
+) -> FAISS:
+    '''
+    Same as `FAISS.from_embeddings` but with an index chosen by the number of vectors and trained on them before
+    they are added, or the given empty (trained) `index`
+    '''
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if index is None:
+        index = new_faiss_index(choose_index_type(len(vectors)), vectors)
+
+    db = FAISS(embedding_function=embeddings, index=index, docstore=InMemoryDocstore(), index_to_docstore_id={})
+    db.add_embeddings(text_embeddings=list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+    return db
+
+
+def _get_documents_and_vectors(db: FAISS, exclude_ids: Iterable[str] = ()) -> Tuple[List[str], List[Document], np.ndarray]:
+    '''
+    Ids, documents and vectors of the vector store in insertion order (the 8-bit quantized vectors of IVF-PQ indexes)
+    '''
+    exclude_ids = set(exclude_ids)
+    positions = [position for position, doc_id in sorted(db.index_to_docstore_id.items()) if doc_id not in exclude_ids]
+    ids = [db.index_to_docstore_id[position] for position in positions]
+    vectors = db.index.reconstruct_n(0, db.index.ntotal)[positions]
+    return ids, [db.docstore.search(doc_id) for doc_id in ids], vectors
+
+
+def _rebuild(db: FAISS, ids: List[str], docs: List[Document], vectors: np.ndarray, index: Optional[faiss.Index] = None) -> FAISS:
+    return build_vector_store(
+        texts=[doc.page_content for doc in docs],
+        vectors=vectors,
+        embeddings=db.embedding_function,
+        metadatas=[doc.metadata for doc in docs],
+        ids=ids,
+        index=index,
+    )
+
+
+def add_documents(db: FAISS, docs: List[Document], vectors: List[List[float]], ids: List[str]) -> Tuple[FAISS, Optional[np.ndarray]]:
+    '''
+    Adds documents to the vector store in place, or rebuilds it with another index type if the knowledgebase
+    outgrew the current one. Returns the vector store and, if it was rebuilt, all its vectors (eg for its report).
+    '''
+    index_type = get_index_type(db.index)
+    if index_type == IndexType.IVF_PQ or choose_index_type(db.index.ntotal + len(docs)) == index_type:
+        db.add_embeddings(
+            text_embeddings=list(zip([doc.page_content for doc in docs], vectors)),
+            metadatas=[doc.metadata for doc in docs],
+            ids=ids,
+        )
+        return db, None
+
+    current_ids, current_docs, current_vectors = _get_documents_and_vectors(db)
+    all_vectors = np.vstack([current_vectors, np.asarray(vectors, dtype=np.float32)])
+    return _rebuild(db, current_ids + ids, current_docs + docs, all_vectors), all_vectors
+
+
+def delete_documents(db: FAISS, ids: List[str]) -> FAISS:
+    '''
+    Deletes documents by id, raises ValueError if any of them does not exist. HNSW graphs and refined IVF-PQ indexes
+    do not support removal, they are rebuilt without them (IVF-PQ keeps its trained quantizers).
+    '''
+    if get_index_type(db.index) == IndexType.FLAT:
+        db.delete(ids)
+        return db
+
+    if missing_ids := set(ids) - set(db.index_to_docstore_id.values()):
+        raise ValueError(f"Some specified ids do not exist in the current store. Ids not found: {missing_ids}")
+
+    empty_index = faiss.clone_index(db.index)
+    empty_index.reset()
+    return _rebuild(db, *_get_documents_and_vectors(db, exclude_ids=ids), index=empty_index)
+
+
+def get_search_parameters(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> Optional[faiss.SearchParameters]:
+    '''
+    Search parameters of one query, the index defaults (set at build time) are used for the ones not given
+    '''
+    index_type = get_index_type(index)
+    if index_type == IndexType.HNSW and ef_search is not None:
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    if index_type == IndexType.IVF_PQ and nprobe is not None:
+        ivf_params = faiss.SearchParametersIVF(nprobe=min(nprobe, _get_ivf_index(index).nlist))
+        return faiss.IndexRefineSearchParameters(k_factor=index.k_factor, base_index_params=ivf_params)
+    return None
+
+
+def search_by_vector(db: FAISS, vector: List[float], k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Tuple[Document, float]]:
+    '''
+    Same as `db.similarity_search_with_score_by_vector` (documents with their distance) but with per-query search
+    parameters, which are passed to the search instead of being set on the index shared by concurrent requests
+    '''
+    query = np.array([vector], dtype=np.float32)
+    if db._normalize_L2:
+        faiss.normalize_L2(query)
+
+    scores, positions = db.index.search(query, k, params=get_search_parameters(db.index, nprobe, ef_search))
+    return [
+        (db.docstore.search(db.index_to_docstore_id[position]), float(score))
+        for score, position in zip(scores[0], positions[0])
+        if position != -1  # fewer than k documents found
+    ]
+
+
+def build_report(index: faiss.Index, vectors: List[List[float]], k: int) -> dict:
+    '''
+    Recall@k (against exact search) and latency per query of the index for each search setting (nprobe or efSearch),
+    measured on a sample of its own vectors used as queries, one query at a time as when serving
+    '''
+    vectors = np.asarray(vectors, dtype=np.float32)
+    k = min(k, len(vectors))
+    sample = np.random.default_rng(0).choice(len(vectors), size=min(INDEX_REPORT_QUERIES, len(vectors)), replace=False)
+    queries = vectors[sample]
+    _, exact_positions = faiss.knn(queries, vectors, k)
+
+    index_type = get_index_type(index)
+    if index_type == IndexType.HNSW:
+        sweep = [("ef_search", ef_search) for ef_search in INDEX_REPORT_EF_SEARCHES]
+    elif index_type == IndexType.IVF_PQ:
+        sweep = [("nprobe", nprobe) for nprobe in INDEX_REPORT_NPROBES if nprobe <= _get_ivf_index(index).nlist]
+    else:
+        sweep = [(None, None)]
+
+    results = []
+    for parameter, value in sweep:
+        params = get_search_parameters(index, **({parameter: value} if parameter else {}))
+        timings, hits = [], 0
+        for query, exact in zip(queries, exact_positions):
+            start = time.perf_counter()
+            _, positions = index.search(query[np.newaxis], k, params=params)
+            timings.append(time.perf_counter() - start)
+            hits += len(set(positions[0]) & set(exact))
+
+        timings.sort()
+        results.append({
+            **({parameter: value} if parameter else {}),
+            f"recall@{k}": round(hits / (k * len(queries)), 4),
+            "median_latency_ms": round(statistics.median(timings) * 1000, 3),
+            "p95_latency_ms": round(timings[int(0.95 * (len(timings) - 1))] * 1000, 3),
+        })
+
+    return {
+        "index_type": index_type,
+        "vectors": index.ntotal,
+        "dimensions": index.d,
+        "queries": len(queries),
+        **({"nlist": _get_ivf_index(index).nlist, "pq_subquantizers": _get_ivf_index(index).pq.M, "refine_k_factor": index.k_factor}
+           if index_type == IndexType.IVF_PQ else {}),
+        **({"hnsw_m": HNSW_M} if index_type == IndexType.HNSW else {}),
+        "results": results,
+    }
@@ -1,41 +1,128 @@
+import json
 import os
-from typing import Dict, Optional
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from asgiref.sync import async_to_sync, sync_to_async
 from django.conf import settings
 
 from langchain_community.vectorstores import FAISS
 from langchain_text_splitters import CharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_core.documents import Document
-from litellm import Router as litellmRouter
+from litellm import Router as litellmRouter, stream_chunk_builder
 
 
-from app.constants import SEMANTIC_ROUTES, DEFAULT_STRONG_MODEL_NAME, DEFAULT_WEAK_MODEL_NAME
+from app.constants import (
+    SEMANTIC_ROUTES, DEFAULT_STRONG_MODEL_NAME, DEFAULT_WEAK_MODEL_NAME, PROMPT_TOKEN_BUDGETS, DEFAULT_PROMPT_TOKEN_BUDGET,
+    HISTORY_TOKEN_SHARE, HISTORY_CANDIDATES, RETRIEVAL_CANDIDATES, RETRIEVAL_SCORE_THRESHOLD,
+)
 from app.enums import OptimizationMetric, LLMName, Role
 from app.utils.llmrouter import LLMRouter
-from app.models import Chat
+from app.utils.llms import LLM, LLMs
+from app.utils.chat_summary import submit_summary_job
+from app.utils.prompt_packing import MESSAGE_OVERHEAD_TOKENS, count_tokens, get_token_count, pack_prompt
+from app.utils.encoders import get_semantic_router_encoder
+from app.utils.index_store import load_index, read_index, save_index, save_index_report, get_index_path, index_write_lock
+from app.utils.ann_index import build_vector_store, add_documents, delete_documents, get_index_type, search_by_vector, build_report
+from app.utils.query_embeddings import QueryEmbeddings
+from app.utils.response_cache import ResponseCache
+from app.models import Chat, Message
+
 
+# the LLM router is created on first use (see `get_llm_router`), so importing this module stays cheap
+_llm_router: Optional[LLMRouter] = None
+_llm_router_lock = threading.Lock()
 
-llm_router = LLMRouter(
-    strong_model_name=DEFAULT_STRONG_MODEL_NAME,
-    weak_model_name=DEFAULT_WEAK_MODEL_NAME,
-    semantic_routes=SEMANTIC_ROUTES,
+# opt-in (settings.RESPONSE_CACHE_ENABLED) cache of AI responses per chat, looked up by query similarity
+response_cache = ResponseCache(
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=settings.RESPONSE_CACHE_TTL,
+    similarity_threshold=settings.RESPONSE_CACHE_SIMILARITY_THRESHOLD,
 )
 
 
 # Note: This is a function, python magic 😁
 get_models: Dict[str, LLMName] = lambda: {
-    "strong_model_name": os.environ['STRONG_MODEL_NAME'],
-    "weak_model_name": os.environ['WEAK_MODEL_NAME'],
+    "strong_model_name": os.environ.get('STRONG_MODEL_NAME', DEFAULT_STRONG_MODEL_NAME.value),
+    "weak_model_name": os.environ.get('WEAK_MODEL_NAME', DEFAULT_WEAK_MODEL_NAME.value),
 }
 
 
+def get_llm_router() -> LLMRouter:
+    '''
+    Returns the process' LLM router, creating it (with the current models) on first call
+    '''
+    global _llm_router
+    if _llm_router is None:
+        with _llm_router_lock:
+            if _llm_router is None:
+                _llm_router = LLMRouter(
+                    **get_models(),
+                    semantic_routes=SEMANTIC_ROUTES,
+                    encoder=get_semantic_router_encoder(settings.SEMANTIC_ROUTER_ENCODER, settings.SEMANTIC_ROUTER_SCORE_THRESHOLD),
+                    route_embeddings_cache_dir=settings.ROUTE_EMBEDDINGS_CACHE_DIR,
+                    hedge_delay=settings.HEDGE_DELAY if settings.HEDGING_ENABLED else None,
+                    hedge_quantile=settings.HEDGE_LATENCY_QUANTILE,
+                )
+    return _llm_router
+
+
 def update_models(strong_model_name: LLMName = DEFAULT_STRONG_MODEL_NAME, weak_model_name: LLMName = DEFAULT_WEAK_MODEL_NAME):
     if strong_model_name not in LLMName or weak_model_name not in LLMName:
         raise ValueError("Invalid model name(s) provided")
     
-    os.environ['STRONG_MODEL_NAME'] = strong_model_name
-    os.environ['WEAK_MODEL_NAME'] = weak_model_name
-    llm_router.update_models(strong_model_name=strong_model_name, weak_model_name=weak_model_name)
+    with _llm_router_lock:
+        os.environ['STRONG_MODEL_NAME'] = strong_model_name
+        os.environ['WEAK_MODEL_NAME'] = weak_model_name
+
+        # a router that is not created yet picks the models up from the environment
+        if _llm_router is not None:
+            _llm_router.update_models(strong_model_name=strong_model_name, weak_model_name=weak_model_name)
+
+
+def warmup() -> dict:
+    '''
+    Builds the LLM router and its components now instead of on the first request, eg for readiness probes
+    '''
+    return get_llm_router().warmup()
+
+
+def similarity_search(db: FAISS, query_embeddings: QueryEmbeddings, k: int = 4, score_threshold: Optional[float] = None,
+                      search_params: Optional[dict] = None):
+    '''
+    Same as `db.similarity_search_with_relevance_scores` but reuses the query embedding of the request if
+    the index's embedding model was already used for it (and shares it otherwise). `search_params` tune the search
+    of approximate indexes for this query (`nprobe` of IVF-PQ, `ef_search` of HNSW indexes).
+    '''
+    embedding_model = db.embedding_function
+    vector = query_embeddings.get(embedding_model.model, embedding_model.embed_query)
+
+    relevance_score_fn = db._select_relevance_score_fn()
+    docs_and_scores = [(doc, relevance_score_fn(score)) for doc, score in search_by_vector(db, vector, k, **(search_params or {}))]
+    if score_threshold is not None:
+        docs_and_scores = [(doc, score) for doc, score in docs_and_scores if score >= score_threshold]
+    return docs_and_scores
+
+
+def embed_documents(docs: List[Document], embeddings: OpenAIEmbeddings) -> List[List[float]]:
+    '''
+    Embeds the documents in batches, with several batches in flight at once
+    '''
+    texts = [doc.page_content for doc in docs]
+    batch_size = settings.EMBEDDING_BATCH_SIZE
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+    with ThreadPoolExecutor(max_workers=settings.EMBEDDING_CONCURRENCY) as executor:
+        return [vector for batch_vectors in executor.map(embeddings.embed_documents, batches) for vector in batch_vectors]
+
+
+def split_knowledgebase(knowledgebase: str) -> List[Document]:
+    text_splitter = CharacterTextSplitter(chunk_size=800, chunk_overlap=200, separator=" ")
+    doc = Document(page_content=knowledgebase)
+    return text_splitter.split_documents([doc])
 
 
 def create_index(knowledgebase: str, chat_id: int):
@@ -43,37 +130,104 @@ def create_index(knowledgebase: str, chat_id: int):
     print(f"-> Creating index for chat {chat_id}", flush=True)
 
     # split text into chunks
-    text_splitter = CharacterTextSplitter(chunk_size=800, chunk_overlap=200, separator=" ")
-    doc = Document(page_content=knowledgebase)
-    docs = text_splitter.split_documents([doc])
+    docs = split_knowledgebase(knowledgebase)
+    count_chunk_tokens(docs)
 
-    # create vector db
-    db = FAISS.from_documents(docs, OpenAIEmbeddings())
+    # create vector db, the index type (exact or approximate search) depends on the number of chunks
+    embeddings = OpenAIEmbeddings()
+    vectors = embed_documents(docs, embeddings)
+    db = build_vector_store(
+        texts=[doc.page_content for doc in docs],
+        vectors=vectors,
+        embeddings=embeddings,
+        metadatas=[doc.metadata for doc in docs],
+    )
 
     # save vector db
-    indexes_dir = settings.INDEXES_DIR
-    if not os.path.exists(indexes_dir):
-        os.makedirs(indexes_dir)
-    db.save_local(os.path.join(indexes_dir, f"{chat_id}.index"))
+    with index_write_lock(chat_id):
+        save_index(db, chat_id)
+        save_index_report(chat_id, build_report(db.index, vectors, k=RETRIEVAL_CANDIDATES))
+    response_cache.invalidate(chat_id)
 
-    print(f"-> Index created for chat {chat_id}", flush=True)
+    print(f"-> Index ({get_index_type(db.index).value}) created for chat {chat_id}", flush=True)
 
 
-def get_ai_response(query: str, chat_id: int, optimization_metric: Optional[OptimizationMetric] = None):
+def add_to_index(knowledgebase: str, chat_id: int) -> List[str]:
+    '''
+    Appends text to a chat's index, only the new chunks are embedded. Returns the ids of the added documents.
+    '''
 
-    print(f"-> Getting AI response for chat {chat_id}", flush=True)
+    print(f"-> Adding to index of chat {chat_id}", flush=True)
+
+    docs = split_knowledgebase(knowledgebase)
+    count_chunk_tokens(docs)
+    vectors = embed_documents(docs, OpenAIEmbeddings())
+    ids = [str(uuid.uuid4()) for _ in docs]
+
+    # modify a fresh copy of the index, the cached one may be in use by requests
+    with index_write_lock(chat_id):
+        db = read_index(get_index_path(chat_id))
+        db, rebuilt_vectors = add_documents(db, docs, vectors, ids)
+        save_index(db, chat_id)
+        if rebuilt_vectors is not None:
+            print(f"-> Index of chat {chat_id} rebuilt as {get_index_type(db.index).value}", flush=True)
+            save_index_report(chat_id, build_report(db.index, rebuilt_vectors, k=RETRIEVAL_CANDIDATES))
+    response_cache.invalidate(chat_id)
+
+    print(f"-> Added {len(ids)} documents to index of chat {chat_id}", flush=True)
+    return ids
+
+
+def delete_from_index(ids: List[str], chat_id: int):
+    '''
+    Deletes documents by id from a chat's index, raises ValueError if any of them does not exist
+    '''
+    with index_write_lock(chat_id):
+        db = delete_documents(read_index(get_index_path(chat_id)), ids)
+        save_index(db, chat_id)
+    response_cache.invalidate(chat_id)
 
-    # retrieve relevant data for context
-    index_path = os.path.join(settings.INDEXES_DIR, f"{chat_id}.index")
-    db = FAISS.load_local(index_path, OpenAIEmbeddings(), allow_dangerous_deserialization=True)
-    relevant_docs_and_scores = db.similarity_search_with_relevance_scores(query, k=4, score_threshold=0.6)
-    context = " ".join([doc.page_content for doc, _ in relevant_docs_and_scores])
-    print(f"- Retrieved context: {context}\n", flush=True)
-
-    # get message history
-    chat = Chat.objects.get(id=chat_id)
-    messages = chat.get_messages(k_recent=4)  # TODO: make k_recent configurable
-    messages = [{"role": message.role, "content": message.content} for message in messages]
+    print(f"-> Deleted {len(ids)} documents from index of chat {chat_id}", flush=True)
+
+
+def get_index_documents(chat_id: int) -> List[dict]:
+    '''
+    Lists the documents (chunks) of a chat's index in insertion order
+    '''
+    db = load_index(chat_id)
+    return [
+        {"id": doc_id, "content": db.docstore.search(doc_id).page_content}
+        for _, doc_id in sorted(db.index_to_docstore_id.items())
+    ]
+
+
+def retrieve_context(chat_id: int, query_embeddings: QueryEmbeddings, search_params: Optional[dict] = None) -> List[Tuple[Document, float]]:
+    '''
+    Retrieves the knowledgebase chunks of a chat most relevant to the query, with their relevance scores.
+    These are candidates, the prompt packing keeps as many as fit the routed model's token budget.
+    '''
+    db = load_index(chat_id)
+    relevant_docs_and_scores = similarity_search(db, query_embeddings, k=RETRIEVAL_CANDIDATES, score_threshold=RETRIEVAL_SCORE_THRESHOLD,
+                                                 search_params=search_params)
+    print(f"- Retrieved {len(relevant_docs_and_scores)} context chunks\n", flush=True)
+    return relevant_docs_and_scores
+
+
+def count_chunk_tokens(docs: List[Document]):
+    '''
+    Caches the token count of each chunk for the current models in its metadata, saved with the index
+    '''
+    models = [LLMs[model_name] for model_name in get_models().values()]
+    for doc in docs:
+        doc.metadata["token_counts"] = {model.name: count_tokens(model, doc.page_content) for model in models}
+
+
+def build_messages(query: str, context: str = "") -> List[dict]:
+    '''
+    Forms the messages to send to the LLM for a user query: system message with the retrieved context (and the
+    summary of the earlier conversation, if any), recent chat history (role and content of each message) and the query itself
+    '''
+    messages = [{"role": message["role"], "content": message["content"]} for message in history]
     
     # add system message
     system_message_template = """You are a helpful chatbot assistant that answers user queries from some data/knolwedgebase.\
@@ -86,6 +240,12 @@ def get_ai_response(query: str, chat_id: int, optimization_metric: Optional[Opti
         {context}
         ```
     """
+    summary_template = """
+        Summary of the earlier conversation (older than the messages in the chat history):
+        ```
+        {summary}
+        ```
+    """
         
     # messages = [{"role": Role.SYSTEM.value, "content": system_message_content}] + messages
 
@@ -107,29 +267,284 @@ def get_ai_response(query: str, chat_id: int, optimization_metric: Optional[Opti
     # messages.append({"role": "user", "content": user_query})
 
     # add system message and user messages to the message history
-    messages = [{"role": Role.SYSTEM.value, "content": system_message_template.format(context=context)}] + messages + [{"role": Role.USER.value, "content": user_query_template.format(query=query)}]
+    system_message = system_message_template.format(context=context) + (summary_template.format(summary=summary) if summary else "")
+    messages = [{"role": Role.SYSTEM.value, "content": system_message}] + messages + [{"role": Role.USER.value, "content": user_query_template.format(query=query)}]
+
+    return messages
+
+
+def _pack_messages(
+    model: LLM,
+    query: str,
+    docs_and_scores: List[Tuple[Document, float]],
+    history: List[dict],
+    summary: str,
+    query_token_counts: dict,
+) -> Tuple[List[dict], dict, List[dict]]:
+    '''
+    Packs the most recent history and the most relevant context chunks into the model's prompt token budget.
+    Returns the messages to send, the prompt's token stats and the history messages whose token counts were computed.
+    '''
+    budget = PROMPT_TOKEN_BUDGETS.get(model.name, DEFAULT_PROMPT_TOKEN_BUDGET)
+
+    # the system prompt (without context, with the chat's summary) and the query are always sent
+    system_message = build_messages(query, "", [], summary)[0]
+    base_tokens = count_tokens(model, system_message["content"]) + get_token_count(query_token_counts, model, query) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+    packed_prompt = pack_prompt(model, budget, base_tokens, docs_and_scores, history, HISTORY_TOKEN_SHARE)
+    messages = build_messages(query, packed_prompt.context, packed_prompt.history, summary)
+    return messages, packed_prompt.stats(budget, len(docs_and_scores), len(history)), packed_prompt.updated_messages
+
+
+def route_and_build_messages(
+    query: str,
+    docs_and_scores: List[Tuple[Document, float]],
+    history: List[dict],
+    summary: str,
+    optimization_metric: Optional[OptimizationMetric],
+    query_embeddings: QueryEmbeddings,
+    query_token_counts: dict,
+) -> Tuple[dict, dict, List[dict]]:
+    '''
+    Routes the query, then packs the prompt into each model's prompt token budget, as the router may call the other
+    model than the routed one (open circuit, failure or hedging). Returns the completion arguments (the routing
+    decision, the models it was made with and the prompt of each model), the prompt token stats by model name and
+    the history messages whose token counts were computed on the way (to be saved).
+    The query's token counts are cached in `query_token_counts`.
+    '''
+    llm_router = get_llm_router()
+    models = llm_router.models
+    routing_decision = llm_router.route_query(query, optimization_metric, query_embeddings, models=models)
+
+    messages_by_model, prompts, updated_messages = {}, {}, {}
+    for model in models.values():
+        messages_by_model[model.name], prompts[model.name], model_updated_messages = _pack_messages(
+            model, query, docs_and_scores, history, summary, query_token_counts)
+        updated_messages.update((message["id"], message) for message in model_updated_messages)
+    routing_decision["prompt"] = prompts[routing_decision["model"]]
+
+    print(f"- Final message history ({routing_decision['prompt']}):\n {"\n".join([str(message) for message in messages_by_model[routing_decision['model']]])}\n", flush=True)
+
+    completion_kwargs = {
+        "messages": messages_by_model[routing_decision["model"]],
+        "messages_by_model": messages_by_model,
+        "models": models,
+        "routing_decision": routing_decision,
+    }
+    return completion_kwargs, prompts, list(updated_messages.values())
+
+
+async def asave_ai_response(chat: Chat, user_message: Message, response, latency: float) -> Message:
+    '''
+    Saves the AI response to the chat (the raw provider response apart, compressed) and the routing decision to
+    the user message it answers
+    '''
+    routing_decision = response["_hidden_params"]["routing_decision"]
+    ai_message = await chat.aadd_message(content=response.choices[0].message.content, role=Role.ASSISTANT.value,
+                     model_used=response.model, payload=response.json() | response["_hidden_params"],
+                     routing_reason=(routing_decision["based_on"] or "")[:255],
+                     prompt_tokens=response.usage.prompt_tokens, completion_tokens=response.usage.completion_tokens,
+                     latency_ms=round(latency * 1000), token_counts={routing_decision["model"]: response.usage.completion_tokens})
 
-    print(f"- Final message history:\n {"\n".join([str(message) for message in messages])}\n", flush=True)
+    # update user message metadata (and its token counts, computed while packing the prompt)
+    user_message.predicted_semantic = routing_decision["predicted_semantic"]
+    user_message.metadata = {"routing_decision": routing_decision}
+    await user_message.asave(update_fields=["predicted_semantic", "metadata", "token_counts"])
+
+    return ai_message
+
+
+def _get_cache_query_vector(chat_id: int, query_embeddings: QueryEmbeddings) -> List[float]:
+    # the query embedding of the chat's index model, already computed for retrieval
+    embedding_model = load_index(chat_id).embedding_function
+    return query_embeddings.get(embedding_model.model, embedding_model.embed_query)
+
+
+def get_cached_ai_response(chat_id: int, query_embeddings: QueryEmbeddings, context: str) -> Optional[dict]:
+    '''
+    Returns a cached response to a similar query with the same retrieved context, if the response cache is enabled
+    '''
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return None
+    return response_cache.get(chat_id, _get_cache_query_vector(chat_id, query_embeddings), context)
+
+
+def cache_ai_response(chat_id: int, query_embeddings: QueryEmbeddings, context: str, response):
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return
+    response_cache.set(chat_id, _get_cache_query_vector(chat_id, query_embeddings), context, {
+        "query": query_embeddings.query,
+        "content": response.choices[0].message.content,
+        "model": response.model,
+        "routing_decision": response["_hidden_params"]["routing_decision"],
+    })
+
+
+async def aget_cached_ai_response(chat_id: int, query_embeddings: QueryEmbeddings, context: str) -> Optional[dict]:
+    '''
+    Async variant of `get_cached_ai_response`, the lookup (index load, query embedding, cache scan) runs in a worker thread
+    '''
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return None
+    return await sync_to_async(get_cached_ai_response, thread_sensitive=False)(chat_id, query_embeddings, context)
+
+
+async def acache_ai_response(chat_id: int, query_embeddings: QueryEmbeddings, context: str, response):
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return
+    await sync_to_async(cache_ai_response, thread_sensitive=False)(chat_id, query_embeddings, context, response)
+
+
+async def asave_cached_ai_response(chat: Chat, user_message: Message, cached_response: dict) -> Message:
+    '''
+    Saves a response from the response cache to the chat, marking it (and the routing decision) as a cache hit
+    '''
+    similarity = cached_response["similarity"]
+    ai_message = await chat.aadd_message(content=cached_response["content"], role=Role.ASSISTANT.value, model_used=cached_response["model"],
+                     metadata={"response_cache": {"hit": True, "similarity": similarity, "cached_query": cached_response["query"]}})
+
+    user_message.metadata = {"routing_decision": cached_response["routing_decision"] | {
+        "query": user_message.content,
+        "based_on": f"Response cache hit (similarity {similarity:.3f} to: {cached_response['query'][:50]})",
+        "cache_hit": True,
+    }}
+    await user_message.asave(update_fields=["metadata"])
+
+    return ai_message
+
+
+async def _aprepare_ai_response(query: str, chat_id: int, search_params: Optional[dict] = None):
+    '''
+    Retrieves the context candidates (in a worker thread) and history candidates for the query, the history
+    candidates are the messages not in the chat's summary yet
+    '''
+
+    # the query is embedded at most once per embedding model for retrieval, routing and response caching
+    query_embeddings = QueryEmbeddings(query)
+
+    chat = await Chat.objects.aget(id=chat_id)
+    docs_and_scores = await sync_to_async(retrieve_context, thread_sensitive=False)(chat_id, query_embeddings, search_params)
+    context = " ".join([doc.page_content for doc, _ in docs_and_scores])  # identifies the retrieved context in the response cache
+    history = await chat.aget_history(k_recent=HISTORY_CANDIDATES, after_summary=True)
+
+    return chat, query_embeddings, docs_and_scores, context, history
+
+
+async def _aroute_and_build_messages(query: str, chat: Chat, user_message: Message, docs_and_scores: List[Tuple[Document, float]], history: List[dict],
+                                     optimization_metric: Optional[OptimizationMetric], query_embeddings: QueryEmbeddings):
+    '''
+    Routes the query and packs the prompt in a worker thread, then saves the history token counts computed on the way
+    '''
+    completion_kwargs, prompts, updated_messages = await sync_to_async(route_and_build_messages, thread_sensitive=False)(
+        query, docs_and_scores, history, chat.summary, optimization_metric, query_embeddings, user_message.token_counts)
+
+    if updated_messages:
+        await Message.objects.abulk_update([Message(id=message["id"], token_counts=message["token_counts"]) for message in updated_messages], ["token_counts"])
+
+    return completion_kwargs, prompts
+
+
+async def aget_ai_response(query: str, chat_id: int, optimization_metric: Optional[OptimizationMetric] = None, search_params: Optional[dict] = None):
+    '''
+    Gets the AI response to a user query and saves both to the chat. Retrieval runs in a worker thread and the
+    LLM call and database writes are awaited so the event loop is never blocked.
+    '''
+
+    print(f"-> Getting AI response for chat {chat_id}", flush=True)
+
+    chat, query_embeddings, docs_and_scores, context, history = await _aprepare_ai_response(query, chat_id, search_params)
 
     # save user message
-    user_message = chat.add_message(content=query, role=Role.USER.value)
+    user_message = await chat.aadd_message(content=query, role=Role.USER.value)
 
-    # # override optimization metric for testing
-    # optimization_metric = OptimizationMetric.LATENCY
-    # get response
-    response = llm_router.completion(messages=messages, optimization_metric=optimization_metric)
-    
-    # save ai response
-    ai_message = chat.add_message(content=response.choices[0].message.content, role=Role.ASSISTANT.value,
-                     model_used=response.model, metadata={"response": response.json() | response["_hidden_params"]})
+    if (cached_response := await aget_cached_ai_response(chat_id, query_embeddings, context)) is not None:
+        ai_message = await asave_cached_ai_response(chat, user_message, cached_response)
+    else:
+        # # override optimization metric for testing
+        # optimization_metric = OptimizationMetric.LATENCY
+        # get response
+        start = time.perf_counter()
+        completion_kwargs, prompts = await _aroute_and_build_messages(query, chat, user_message, docs_and_scores, history, optimization_metric, query_embeddings)
+        response = await get_llm_router().acompletion(optimization_metric=optimization_metric, query_embeddings=query_embeddings, **completion_kwargs)
+        # the stats of the prompt actually sent, the router may have fallen back to the other model
+        routing_decision = response["_hidden_params"]["routing_decision"]
+        routing_decision["prompt"] = prompts[routing_decision["model"]]
+
+        # save ai response
+        ai_message = await asave_ai_response(chat, user_message, response, latency=time.perf_counter() - start)
+        await acache_ai_response(chat_id, query_embeddings, context, response)
 
-    # update user message metadata
-    user_message.metadata = {"routing_decision": response["_hidden_params"]["routing_decision"]}
-    user_message.save()
+    # fold the messages falling out of the recent history into the chat's summary
+    submit_summary_job(chat_id, get_llm_router())
 
-    print(f"AI response obtained: {response.choices[0].message.content}\n", flush=True)
+    print(f"AI response obtained: {ai_message.content}\n", flush=True)
 
     return {
         "user_message": user_message.serialize(),
         "ai_message": ai_message.serialize(),
     }
+
+
+# synchronous entry point, eg for scripts and the shell
+get_ai_response = async_to_sync(aget_ai_response)
+
+
+def _server_sent_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def astream_ai_response(query: str, chat_id: int, optimization_metric: Optional[OptimizationMetric] = None, search_params: Optional[dict] = None) -> AsyncIterator[str]:
+    '''
+    Streaming variant of `aget_ai_response`, yields Server-Sent Events: the routing decision first, then
+    the response tokens as they are generated and finally the saved user and AI messages
+    '''
+
+    print(f"-> Streaming AI response for chat {chat_id}", flush=True)
+
+    chat, query_embeddings, docs_and_scores, context, history = await _aprepare_ai_response(query, chat_id, search_params)
+
+    user_message = await chat.aadd_message(content=query, role=Role.USER.value)
+
+    if (cached_response := await aget_cached_ai_response(chat_id, query_embeddings, context)) is not None:
+        ai_message = await asave_cached_ai_response(chat, user_message, cached_response)
+        submit_summary_job(chat_id, get_llm_router())
+        yield _server_sent_event("routing_decision", user_message.metadata["routing_decision"])
+        yield _server_sent_event("token", {"content": ai_message.content})
+        yield _server_sent_event("done", {
+            "user_message": user_message.serialize(),
+            "ai_message": ai_message.serialize(),
+        })
+        return
+
+    start = time.perf_counter()
+    try:
+        completion_kwargs, prompts = await _aroute_and_build_messages(query, chat, user_message, docs_and_scores, history, optimization_metric, query_embeddings)
+        routing_decision, stream = await get_llm_router().astream_completion(optimization_metric=optimization_metric, query_embeddings=query_embeddings, **completion_kwargs)
+        routing_decision["prompt"] = prompts[routing_decision["model"]]
+        messages = completion_kwargs["messages_by_model"][routing_decision["model"]]
+        yield _server_sent_event("routing_decision", routing_decision)
+
+        chunks = []
+        async for chunk in stream:
+            chunks.append(chunk)
+            if token := chunk.choices[0].delta.content:
+                yield _server_sent_event("token", {"content": token})
+
+    except Exception as error:
+        print(f"Error streaming AI response: {error}", flush=True)
+        yield _server_sent_event("error", {"error": str(error)})
+        return
+
+    # rebuild the complete response from its chunks and save it once the stream has finished
+    response = stream_chunk_builder(chunks, messages=messages)
+    response["_hidden_params"]["routing_decision"] = routing_decision
+    ai_message = await asave_ai_response(chat, user_message, response, latency=time.perf_counter() - start)
+    await acache_ai_response(chat_id, query_embeddings, context, response)
+    submit_summary_job(chat_id, get_llm_router())
+
+    print(f"AI response streamed: {response.choices[0].message.content}\n", flush=True)
+
+    yield _server_sent_event("done", {
+        "user_message": user_message.serialize(),
+        "ai_message": ai_message.serialize(),
+    })
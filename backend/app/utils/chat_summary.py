@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from app.constants import SUMMARY_RECENT_MESSAGES, SUMMARY_BATCH_SIZE, SUMMARY_MAX_WORDS
+from app.enums import LLMType, Role
+from app.models import Chat
+
+
+# worker pool updating chat summaries outside of the request/response cycle
+executor = ThreadPoolExecutor(max_workers=settings.SUMMARY_WORKERS, thread_name_prefix="summary")
+
+# chats with a summary update queued or running, a new turn does not queue another one
+_scheduled = set()
+_scheduled_lock = threading.Lock()
+
+
+def build_summary_messages(summary: str, messages: List[dict]) -> List[dict]:
+    '''
+    Forms the messages asking the LLM to fold new chat messages into the current summary
+    '''
+    system_message = f"""You maintain a running summary of a conversation between a user and an assistant.\
+        You will be given the current summary (it may be empty) and the messages that followed it. Rewrite the summary so that it also covers the new messages.\
+        Keep the facts, names, numbers, decisions, user preferences and open questions needed to continue the conversation, drop small talk.\
+        Answer with the summary only, in at most {SUMMARY_MAX_WORDS} words.
+    """
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    user_message = f"Current summary:\n```\n{summary}\n```\n\nNew messages:\n```\n{transcript}\n```"
+    return [{"role": Role.SYSTEM.value, "content": system_message}, {"role": Role.USER.value, "content": user_message}]
+
+
+def update_summary(chat_id: int, llm_router) -> bool:
+    '''
+    Folds the chat's messages that are older than the last SUMMARY_RECENT_MESSAGES and not summarized yet into its
+    summary with the weak model, SUMMARY_BATCH_SIZE messages per LLM call. Returns whether the summary changed.
+    '''
+    updated = False
+    while True:
+        chat = Chat.objects.only("summary", "summarized_until").get(id=chat_id)
+        unsummarized = chat.messages.all()
+        if chat.summarized_until is not None:
+            unsummarized = unsummarized.filter(sent_at__gt=chat.summarized_until)
+
+        # oldest first, the latest messages stay out of the summary as they are sent verbatim
+        count = unsummarized.count()
+        if count <= SUMMARY_RECENT_MESSAGES:
+            return updated
+        messages = list(unsummarized.order_by("sent_at").values("role", "content", "sent_at")[:min(count - SUMMARY_RECENT_MESSAGES, SUMMARY_BATCH_SIZE)])
+
+        response = llm_router.model_completion(LLMType.WEAK, messages=build_summary_messages(chat.summary, messages))
+        summary = response.choices[0].message.content.strip()
+
+        # only if no other update got there first, otherwise start over from its summary
+        if Chat.objects.filter(id=chat_id, summarized_until=chat.summarized_until).update(summary=summary, summarized_until=messages[-1]["sent_at"]):
+            print(f"-> Summarized {len(messages)} messages of chat {chat_id}", flush=True)
+            updated = True
+
+
+def _update_summary(chat_id: int, llm_router):
+    with _scheduled_lock:
+        _scheduled.discard(chat_id)
+
+    close_old_connections()
+    try:
+        update_summary(chat_id, llm_router)
+    except Exception as e:
+        # the messages stay unsummarized (and sent verbatim) until the next turn's update
+        print(f"Error updating summary of chat {chat_id}: {e}", flush=True)
+    finally:
+        close_old_connections()
+
+
+def submit_summary_job(chat_id: int, llm_router) -> Optional[Future]:
+    '''
+    Updates the summary of a chat in the background, unless an update of the chat is already queued
+    '''
+    with _scheduled_lock:
+        if chat_id in _scheduled:
+            return None
+        _scheduled.add(chat_id)
+    return executor.submit(_update_summary, chat_id, llm_router)
@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict
+
+from app.enums import CircuitState
+
+
+class CircuitOpenError(Exception):
+    '''
+    Raised when no model is available for a request because their circuits are open
+    '''
+
+
+class CircuitBreaker:
+    '''
+    Health of a model backend. The circuit opens (requests to the model are refused) after `failure_threshold`
+    consecutive failures, or when at least `error_rate_threshold` of the last `window` requests failed.
+    After `open_duration` seconds it turns half-open and lets one probe request through every `open_duration`
+    seconds: a successful probe closes the circuit, a failed one opens it again.
+    '''
+
+    def __init__(self, failure_threshold: int = 5, error_rate_threshold: float = 0.5, window: int = 20, open_duration: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.open_duration = open_duration
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.outcomes = deque(maxlen=window)  # 1 for a failure, 0 for a success
+        self.opened_at = None
+        self.next_probe_at = None
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def allow_request(self) -> bool:
+        now = time.monotonic()
+        if self.state == CircuitState.OPEN and now - self.opened_at >= self.open_duration:
+            self.state = CircuitState.HALF_OPEN
+            self.next_probe_at = now
+
+        if self.state == CircuitState.HALF_OPEN:
+            # a probe that never reports back (eg cancelled) does not block the next one for long
+            if now < self.next_probe_at:
+                return False
+            self.next_probe_at = now + self.open_duration
+            return True
+
+        return self.state == CircuitState.CLOSED
+
+    def record_success(self):
+        if self.state != CircuitState.CLOSED:
+            self.state = CircuitState.CLOSED
+            self.outcomes.clear()
+        self.consecutive_failures = 0
+        self.outcomes.append(0)
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.outcomes.append(1)
+
+        window_full = len(self.outcomes) == self.outcomes.maxlen
+        if (
+            self.state == CircuitState.HALF_OPEN
+            or self.consecutive_failures >= self.failure_threshold
+            or (window_full and self.error_rate >= self.error_rate_threshold)
+        ):
+            self.state = CircuitState.OPEN
+            self.opened_at = time.monotonic()
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "error_rate": self.error_rate,
+            "requests_in_window": len(self.outcomes),
+            "retry_in": max(0.0, self.opened_at + self.open_duration - time.monotonic()) if self.state == CircuitState.OPEN else None,
+        }
+
+
+class CircuitBreakers:
+    '''
+    Per-process circuit breakers of every model, keyed by model name
+    '''
+
+    def __init__(self, **breaker_kwargs):
+        self._breakers: Dict[str, CircuitBreaker] = defaultdict(lambda: CircuitBreaker(**breaker_kwargs))
+        self._lock = threading.Lock()
+
+    def allow_request(self, model_name: str) -> bool:
+        with self._lock:
+            return self._breakers[model_name].allow_request()
+
+    def record_success(self, model_name: str):
+        with self._lock:
+            self._breakers[model_name].record_success()
+
+    def record_failure(self, model_name: str):
+        with self._lock:
+            self._breakers[model_name].record_failure()
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {model_name: breaker.to_dict() for model_name, breaker in self._breakers.items()}
+
+
+circuit_breakers = CircuitBreakers()
@@ -0,0 +1,54 @@
+import zlib
+from typing import List, Optional
+
+import numpy as np
+from semantic_router.encoders import BaseEncoder, OpenAIEncoder
+
+
+class HashingNGramEncoder(BaseEncoder):
+    '''
+    Local encoder for the semantic router: character n-gram counts hashed into a fixed size vector and L2 normalized.
+    Needs no model files or network, encodes a batch of texts in well under a millisecond per text and is
+    deterministic across processes.
+    '''
+    name: str = "hashing-ngram-2-4-1024"
+    type: str = "hashing"
+    # separates paraphrases of the semantic routes' utterances from unrelated queries, see app/tests/test_encoders.py
+    score_threshold: float = 0.35
+    dimensions: int = 1024
+    min_n: int = 2
+    max_n: int = 4
+
+    def __call__(self, docs: List[str]) -> List[List[float]]:
+        vectors = np.zeros((len(docs), self.dimensions), dtype=np.float32)
+
+        for row, doc in enumerate(docs):
+            text = f" {' '.join(doc.casefold().split())} "
+            for n in range(self.min_n, self.max_n + 1):
+                for i in range(len(text) - n + 1):
+                    vectors[row, zlib.crc32(text[i:i + n].encode()) % self.dimensions] += 1
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return (vectors / norms).tolist()
+
+
+def get_semantic_router_encoder(name: str, score_threshold: Optional[float] = None) -> BaseEncoder:
+    '''
+    Returns the semantic router encoder configured by name: "openai" (default), "hashing" (local, no network)
+    or "fastembed" (local ONNX embedding model, needs the optional `fastembed` package).
+    `score_threshold` overrides the encoder's default threshold for matching a semantic route.
+    '''
+    if name == "openai":
+        encoder = OpenAIEncoder()
+    elif name == "hashing":
+        encoder = HashingNGramEncoder()
+    elif name == "fastembed":
+        from semantic_router.encoders import FastEmbedEncoder
+        encoder = FastEmbedEncoder()
+    else:
+        raise ValueError(f"Invalid semantic router encoder: {name}")
+
+    if score_threshold is not None:
+        encoder.score_threshold = score_threshold
+    return encoder
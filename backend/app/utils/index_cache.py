@@ -0,0 +1,94 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple
+
+
+class IndexCache:
+    '''
+    Per-process LRU cache of loaded vector indexes.
+
+    Entries are keyed (eg by chat id) and remember the on-disk signature of the index they were loaded from,
+    so an index that is rebuilt or updated on disk is reloaded on the next access. The total size of the cached
+    indexes (approximated by their size on disk) is kept under `max_bytes` by evicting the least recently used ones.
+    '''
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[Any, tuple, int]]" = OrderedDict()  # key -> (index, signature, size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _signature(path: str) -> Tuple[tuple, int]:
+        '''
+        Returns the signature (file names, mtimes and sizes) and the total size in bytes of the index at `path`.
+        '''
+        if os.path.isdir(path):
+            files = sorted((entry.name, entry.stat()) for entry in os.scandir(path) if entry.is_file())
+        else:
+            files = [(os.path.basename(path), os.stat(path))]
+
+        signature = tuple((name, stat.st_mtime_ns, stat.st_size) for name, stat in files)
+        return signature, sum(stat.st_size for _, stat in files)
+
+    def get(self, key: Hashable, path: str, loader: Callable[[str], Any]) -> Any:
+        '''
+        Returns the index for `key`, loading it from `path` with `loader` if it is not cached or changed on disk.
+        '''
+        signature, size = self._signature(path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # load outside the lock so that other chats are not blocked while this index is deserialized
+        index = loader(path)
+
+        with self._lock:
+            self._remove(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (index, signature, size)
+                self._size += size
+                self._evict()
+
+        return index
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
@@ -0,0 +1,50 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from app.enums import IndexStatus
+from app.models import Chat
+from app.utils.chat import create_index
+
+
+# worker pool building chat indexes outside of the request/response cycle
+executor = ThreadPoolExecutor(max_workers=settings.INDEXING_WORKERS, thread_name_prefix="indexing")
+
+
+def _build_index(knowledgebase: str, chat_id: int):
+    close_old_connections()
+    try:
+        create_index(knowledgebase, chat_id)
+        Chat.objects.filter(id=chat_id).update(index_status=IndexStatus.READY.value, index_error=None, pending_knowledgebase=None)
+    except Exception as e:
+        print(f"Error creating index for chat {chat_id}: {e}", flush=True)
+        Chat.objects.filter(id=chat_id).update(index_status=IndexStatus.FAILED.value, index_error=str(e), pending_knowledgebase=None)
+    finally:
+        close_old_connections()
+
+
+def submit_index_job(knowledgebase: str, chat_id: int) -> Future:
+    '''
+    Builds the index of a chat in the background, its progress is tracked by the chat's `index_status`
+    (chats are created with a pending index and their knowledgebase kept in `pending_knowledgebase`)
+    '''
+    return executor.submit(_build_index, knowledgebase, chat_id)
+
+
+def resume_index_jobs() -> List[int]:
+    '''
+    Resubmits the index jobs lost by a restart of the server (the chats still pending with their knowledgebase),
+    and fails the pending chats whose knowledgebase was not kept. Returns the ids of the resubmitted chats.
+    Runs once per server process at startup, before any job is submitted.
+    '''
+    Chat.objects.filter(index_status=IndexStatus.PENDING.value, pending_knowledgebase__isnull=True).update(
+        index_status=IndexStatus.FAILED.value, index_error="Indexing was interrupted by a restart, create the chat again")
+
+    chat_ids = []
+    for chat_id, knowledgebase in Chat.objects.filter(index_status=IndexStatus.PENDING.value).values_list("id", "pending_knowledgebase"):
+        print(f"Resuming index job of chat {chat_id}", flush=True)
+        submit_index_job(knowledgebase, chat_id)
+        chat_ids.append(chat_id)
+    return chat_ids
@@ -0,0 +1,190 @@
+import fcntl
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+import faiss
+from django.conf import settings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_openai import OpenAIEmbeddings
+
+from app.utils.index_cache import IndexCache
+from app.utils.sqlite_docstore import SQLiteDocstore
+
+
+# Each chat's index lives in its own directory. Every save writes a new version of the index files next to
+# the current one and then atomically swaps the `CURRENT` pointer file to it, so readers never see a
+# partially written index. Indexes saved before versioning have no pointer and use the default name.
+# A version is the raw FAISS index (`<name>.faiss`) and its chunks in SQLite (`<name>.sqlite`), nothing is pickled.
+# Versions saved by langchain (`<name>.pkl` docstore) are converted by the `convert_indexes` command.
+CURRENT_POINTER = "CURRENT"
+DEFAULT_INDEX_NAME = "index"
+LOCK_FILE = ".lock"
+REPORT_FILE = "report.json"  # recall/latency report of the latest build (see `app.utils.ann_index.build_report`)
+INDEX_FILE_EXTENSIONS = ("faiss", "sqlite", "pkl")
+
+# the index data is mapped from the file instead of copied in memory, its pages are shared by the processes through
+# the OS cache (zero-copy for the vectors with faiss versions supporting it)
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+# loaded vector indexes of active chats, kept in memory between messages
+index_cache = IndexCache(max_bytes=settings.INDEX_CACHE_MAX_BYTES)
+
+
+def get_index_path(chat_id: int) -> str:
+    return os.path.join(settings.INDEXES_DIR, f"{chat_id}.index")
+
+
+def _get_current_index_name(path: str) -> str:
+    try:
+        with open(os.path.join(path, CURRENT_POINTER)) as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return DEFAULT_INDEX_NAME
+
+
+def _read_current_version(path: str, reader):
+    try:
+        return reader(path, _get_current_index_name(path))
+    except FileNotFoundError:
+        # the version just read was replaced (and removed) by a concurrent save, load the new one
+        return reader(path, _get_current_index_name(path))
+
+
+def _get_version_paths(path: str, index_name: str) -> tuple:
+    faiss_path, sqlite_path = os.path.join(path, f"{index_name}.faiss"), os.path.join(path, f"{index_name}.sqlite")
+    for file_path in (faiss_path, sqlite_path):
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+    return faiss_path, sqlite_path
+
+
+def _open_version(path: str, index_name: str) -> FAISS:
+    faiss_path, sqlite_path = _get_version_paths(path, index_name)
+    docstore = SQLiteDocstore(sqlite_path)
+    return FAISS(OpenAIEmbeddings(), faiss.read_index(faiss_path, MMAP_FLAGS), docstore, docstore.index_to_docstore_id)
+
+
+def _read_version(path: str, index_name: str) -> FAISS:
+    faiss_path, sqlite_path = _get_version_paths(path, index_name)
+    chunks = list(SQLiteDocstore(sqlite_path).iter_documents())
+    return FAISS(
+        OpenAIEmbeddings(),
+        faiss.read_index(faiss_path),
+        InMemoryDocstore({doc_id: doc for _, doc_id, doc in chunks}),
+        {position: doc_id for position, doc_id, _ in chunks},
+    )
+
+
+def open_index(path: str) -> FAISS:
+    '''
+    Opens the current version of the index at `path` read-only: the FAISS index is memory-mapped and the chunks
+    are read from SQLite on demand, so opening costs next to nothing whatever the index size
+    '''
+    return _read_current_version(path, _open_version)
+
+
+def read_index(path: str) -> FAISS:
+    '''
+    Loads the current version of the index at `path` from disk into memory, to modify it
+    '''
+    return _read_current_version(path, _read_version)
+
+
+def load_index(chat_id: int) -> FAISS:
+    '''
+    Returns the vector index of a chat, from the in-process cache if it is already opened and unchanged on disk.
+    The returned index is shared and read-only, use `read_index` to get a copy to modify.
+    '''
+    return index_cache.get(chat_id, get_index_path(chat_id), open_index)
+
+
+def save_index(db: FAISS, chat_id: int):
+    '''
+    Atomically replaces the index of a chat with `db`
+    '''
+    path = get_index_path(chat_id)
+    os.makedirs(path, exist_ok=True)
+
+    previous_index_name = _get_current_index_name(path)
+    index_name = f"{DEFAULT_INDEX_NAME}-{uuid.uuid4().hex}"
+    faiss.write_index(db.index, os.path.join(path, f"{index_name}.faiss"))
+    SQLiteDocstore.write(
+        os.path.join(path, f"{index_name}.sqlite"),
+        ((position, doc_id, db.docstore.search(doc_id)) for position, doc_id in db.index_to_docstore_id.items()),
+    )
+
+    # swap the pointer to the new version
+    pointer_path = os.path.join(path, CURRENT_POINTER)
+    with open(f"{pointer_path}.tmp", "w") as file:
+        file.write(index_name)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(f"{pointer_path}.tmp", pointer_path)
+
+    # remove the previous version
+    for extension in INDEX_FILE_EXTENSIONS:
+        try:
+            os.remove(os.path.join(path, f"{previous_index_name}.{extension}"))
+        except FileNotFoundError:
+            pass
+
+    index_cache.invalidate(chat_id)
+
+
+def convert_index(chat_id: int) -> bool:
+    '''
+    Converts the current version of a chat's index from langchain's format (pickled docstore) to the pickle-free one,
+    returns whether it was converted
+    '''
+    path = get_index_path(chat_id)
+    with index_write_lock(chat_id):
+        index_name = _get_current_index_name(path)
+        if not os.path.exists(os.path.join(path, f"{index_name}.pkl")) or os.path.exists(os.path.join(path, f"{index_name}.sqlite")):
+            return False
+
+        # unpickled one last time, these files were written by this app
+        db = FAISS.load_local(path, OpenAIEmbeddings(), index_name=index_name, allow_dangerous_deserialization=True)
+        save_index(db, chat_id)
+    return True
+
+
+def save_index_report(chat_id: int, report: dict):
+    '''
+    Saves the build report of a chat's current index, with the size of the index file
+    '''
+    path = get_index_path(chat_id)
+    report = report | {"index_bytes": os.path.getsize(os.path.join(path, f"{_get_current_index_name(path)}.faiss"))}
+
+    report_path = os.path.join(path, REPORT_FILE)
+    with open(f"{report_path}.tmp", "w") as file:
+        json.dump(report, file, indent=2)
+    os.replace(f"{report_path}.tmp", report_path)
+
+
+def get_index_report(chat_id: int) -> Optional[dict]:
+    try:
+        with open(os.path.join(get_index_path(chat_id), REPORT_FILE)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def index_write_lock(chat_id: int):
+    '''
+    Serializes read-modify-save cycles on a chat's index across threads and processes
+    '''
+    path = get_index_path(chat_id)
+    os.makedirs(path, exist_ok=True)
+
+    with open(os.path.join(path, LOCK_FILE), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -1,14 +1,29 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Dict, List, Optional, Sequence, Tuple
 
-from semantic_router.encoders import OpenAIEncoder
+import numpy as np
+import torch
+from semantic_router.encoders import BaseEncoder, OpenAIEncoder
 from semantic_router.layer import RouteLayer as SemanticRouteLayer
 from routellm.controller import Controller
-from litellm import completion
+from litellm import acompletion, completion
 
+from app.constants import (
+    DEFAULT_STRONG_MODEL_NAME, DEFAULT_WEAK_MODEL_NAME, ROUTELLM_ROUTER, ROUTELLM_MF_CHECKPOINT, ROUTELLM_MF_THRESHOLD,
+    ROUTING_CACHE_MAX_SIZE, ROUTING_CACHE_TTL, ROUTING_BATCH_SIZE,
+)
 from app.enums import LLMName, LLMType, OptimizationMetric
 from app.utils.semantic_route import SemanticRoute
-from app.utils.llms import LLMs
+from app.utils.route_embeddings import build_semantic_route_layer
+from app.utils.llms import LLM, LLMs
+from app.utils.query_embeddings import QueryEmbeddings, openai_embed, openai_embed_batch
+from app.utils.telemetry import telemetry
+from app.utils.circuit_breaker import CircuitOpenError, circuit_breakers
+from app.utils.ttl_cache import TTLCache
 
 
 @dataclass
@@ -18,6 +33,10 @@ class RoutingDecision:
     model_type: LLMType
     predicted_semantic: Optional[str] = None
     optimization_metric: Optional[OptimizationMetric] = None
+    based_on: Optional[str] = None
+    hedge_delay: Optional[float] = None
+    hedge_winner: Optional[str] = None
+    hedge_reason: Optional[str] = None
 
     def to_dict(self):
         return {
@@ -26,6 +45,10 @@ class RoutingDecision:
             "model": self.model,
             "model_type": self.model_type,
             "optimization_metric": self.optimization_metric,
+            "based_on": self.based_on,
+            "hedge_delay": self.hedge_delay,
+            "hedge_winner": self.hedge_winner,
+            "hedge_reason": self.hedge_reason,
         }
     
     @classmethod
@@ -36,7 +59,106 @@ class RoutingDecision:
             model=data["model"],
             model_type=data["model_type"],
             optimization_metric=data.get("optimization_metric"),
+            based_on=data.get("based_on"),
+            hedge_delay=data.get("hedge_delay"),
+            hedge_winner=data.get("hedge_winner"),
+            hedge_reason=data.get("hedge_reason"),
         )
+
+
+def _mf_strong_win_rates(mf_router, prompt_embeddings: Sequence[Sequence[float]]) -> np.ndarray:
+    '''
+    Strong model win rates of RouteLLM's matrix factorization router for already embedded prompts.
+    Mirrors `MFModel.pred_win_rate` but takes the prompt embeddings instead of embedding the prompts itself.
+    '''
+    model = mf_router.model
+    device = model.get_device()
+
+    with torch.no_grad():
+        model_ids = torch.tensor([mf_router.strong_model_id, mf_router.weak_model_id], dtype=torch.long, device=device)
+        model_embed = torch.nn.functional.normalize(model.P(model_ids), p=2, dim=1)  # (2, dim)
+
+        prompt_embed = torch.as_tensor(np.asarray(prompt_embeddings, dtype=np.float32), device=device)  # (n, text_dim)
+        if getattr(model, "use_proj", True):
+            prompt_embed = model.text_proj(prompt_embed)  # (n, dim)
+
+        logits = model.classifier(prompt_embed[:, None, :] * model_embed[None, :, :]).squeeze(-1)  # (n, 2)
+        return torch.sigmoid(logits[:, 0] - logits[:, 1]).cpu().numpy()
+
+
+# RouteLLM controllers by (router, checkpoint), shared by the LLM routers of the process: the router's weights and the
+# win rates they give do not depend on the models routed between (see `_mf_strong_win_rates`)
+_routellm_controllers: Dict[Tuple[str, str], Controller] = {}
+_routellm_controllers_lock = threading.Lock()
+
+
+def get_routellm_controller(router: str = ROUTELLM_ROUTER, checkpoint_path: str = ROUTELLM_MF_CHECKPOINT) -> Controller:
+    '''
+    Returns the RouteLLM controller of a router and checkpoint, built once (loading the checkpoint) and kept
+    '''
+    key = (router, checkpoint_path)
+    if (controller := _routellm_controllers.get(key)) is None:
+        with _routellm_controllers_lock:
+            if (controller := _routellm_controllers.get(key)) is None:
+                # the controller's model names are only used by its own completions, requests are routed with the
+                # win rates of its router and completed by the LLM router
+                controller = Controller(
+                    routers=[router],
+                    strong_model=DEFAULT_STRONG_MODEL_NAME.value,
+                    weak_model=DEFAULT_WEAK_MODEL_NAME.value,
+                    config={router: {"checkpoint_path": checkpoint_path}},
+                )
+                _routellm_controllers[key] = controller
+    return controller
+
+
+class PrependedStream:
+    '''
+    The chunks of a stream whose first chunk was already read (to know the model answered): `first_chunk`, then
+    the rest of `stream`. Closing it closes `stream`, even if it was never iterated.
+    '''
+
+    def __init__(self, first_chunk, stream):
+        self._first_chunk = first_chunk
+        self._stream = stream
+        self._started = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._started:
+            self._started = True
+            return self._first_chunk
+        return next(self._stream)
+
+    def close(self):
+        self._stream.close()
+
+
+class AsyncPrependedStream:
+    '''
+    Async variant of `PrependedStream`, iterated with `async for` and closed with `aclose`
+    '''
+
+    def __init__(self, first_chunk, stream):
+        self._first_chunk = first_chunk
+        self._stream = stream
+        self._started = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._started:
+            self._started = True
+            return self._first_chunk
+        return await anext(self._stream)
+
+    async def aclose(self):
+        await self._stream.aclose()
+
+
 class LLMRouter:
 
     def __init__(
@@ -44,30 +166,87 @@ class LLMRouter:
         strong_model_name: LLMName,
         weak_model_name: LLMName,
         semantic_routes: Optional[List[SemanticRoute]] = None,
+        encoder: Optional[BaseEncoder] = None,
+        route_embeddings_cache_dir: Optional[str] = None,
+        hedge_delay: Optional[float] = None,
+        hedge_quantile: Optional[float] = None,
     ):
         if semantic_routes is None:
             semantic_routes = []
 
-        self.models = {
+        # the active strong and weak models, replaced as a whole (never mutated) when the models are updated so that
+        # every request routes and completes with one consistent pair
+        self._models = {
             "strong": LLMs[strong_model_name],
             "weak": LLMs[weak_model_name],
         }
 
         self.semantic_routes = {route.name: route for route in semantic_routes}
-        self.semantic_router_layer = SemanticRouteLayer(encoder=OpenAIEncoder(), routes=semantic_routes)
 
-        self.routellm_controller = Controller(routers=["mf"], strong_model=self.models["strong"].name, weak_model=self.models["weak"].name)
+        # the semantic router layer and RouteLLM controller are expensive to build (encoder, route embeddings,
+        # MF checkpoint), they are built on first use (or by `warmup`), exactly once even with concurrent requests
+        self._encoder = encoder
+        self._route_embeddings_cache_dir = route_embeddings_cache_dir
+        self._semantic_router_layer = None
+        self._semantic_router_layer_lock = threading.Lock()
+
+        # semantic and difficulty based routing decisions of recent queries
+        self.routing_cache = TTLCache(maxsize=ROUTING_CACHE_MAX_SIZE, ttl=ROUTING_CACHE_TTL)
+
+        # hedged requests (availability metric only, disabled when `hedge_delay` is None): if the preferred model has
+        # not answered after the `hedge_quantile` of its observed latency (or `hedge_delay` seconds until there are
+        # observations), the request is also sent to the other model and the first answer wins
+        self.hedge_delay = hedge_delay
+        self.hedge_quantile = hedge_quantile
+        self._hedge_executor = ThreadPoolExecutor(thread_name_prefix="llm-hedge") if hedge_delay is not None else None
+
+    @property
+    def semantic_router_layer(self) -> SemanticRouteLayer:
+        if self._semantic_router_layer is None:
+            with self._semantic_router_layer_lock:
+                if self._semantic_router_layer is None:
+                    encoder = self._encoder or OpenAIEncoder()
+                    semantic_routes = list(self.semantic_routes.values())
+                    if self._route_embeddings_cache_dir is not None:
+                        # utterance embeddings are precomputed once and shared by all processes through the cache directory
+                        self._semantic_router_layer = build_semantic_route_layer(encoder, semantic_routes, self._route_embeddings_cache_dir)
+                    else:
+                        self._semantic_router_layer = SemanticRouteLayer(encoder=encoder, routes=semantic_routes)
+        return self._semantic_router_layer
+
+    @property
+    def models(self) -> Dict[str, LLM]:
+        return self._models
+
+    @property
+    def routellm_controller(self) -> Controller:
+        return get_routellm_controller()
+
+    def warmup(self) -> dict:
+        '''
+        Builds the semantic router layer and RouteLLM controller now instead of on the first request,
+        returns the time taken by each (in seconds)
+        '''
+        timings = {}
+        for name in ("semantic_router_layer", "routellm_controller"):
+            start = time.perf_counter()
+            getattr(self, name)
+            timings[name] = round(time.perf_counter() - start, 3)
+        return timings
 
 
     def update_models(self, strong_model_name: LLMName, weak_model_name: LLMName):
-        self.models.update({
+        models = {
             "strong": LLMs[strong_model_name],
             "weak": LLMs[weak_model_name],
-        })
-        self.routellm_controller = Controller(routers=["mf"], strong_model=self.models["strong"].name, weak_model=self.models["weak"].name)
+        }
+
+        # swap atomically, in-flight requests keep using the models they started with
+        self._models = models
+        self.routing_cache.clear()
 
         
-    def _route_based_on_optimization_metric(self, query: str, optimization_metric: OptimizationMetric) -> dict:
+    def _route_based_on_optimization_metric(self, query: str, optimization_metric: OptimizationMetric, models: Dict[str, LLM]) -> dict:
         based_on = f"Optimization_metric: {optimization_metric.value}"
 
         # determine model type based on optimization metric
@@ -79,25 +258,32 @@ class LLMRouter:
             based_on = based_on + " , routing to weak model"
         else:  # optimization_metric is Latency
 
-            # decide based on tokens per second
-            strong_model_tps = self.models["strong"].tokens_per_second
-            weak_model_tps = self.models["weak"].tokens_per_second
-            model_type = LLMType.STRONG if (strong_model_tps >= weak_model_tps) else LLMType.WEAK
-            based_on = based_on + f" , routing to {model_type.value} model due to higher TPS ({strong_model_tps} vs {weak_model_tps})"
+            # decide based on the measured time to answer (time to first token, generation time and error rate)
+            strong_model_latency = models["strong"].expected_latency
+            weak_model_latency = models["weak"].expected_latency
+            if strong_model_latency is None or weak_model_latency is None:
+                # route to a model that has not been measured yet so that it gets measured (weak one first)
+                model_type = LLMType.WEAK if weak_model_latency is None else LLMType.STRONG
+                based_on = based_on + f" , routing to {model_type.value} model as its latency is not measured yet"
+            else:
+                model_type = LLMType.STRONG if (strong_model_latency <= weak_model_latency) else LLMType.WEAK
+                based_on = based_on + f" , routing to {model_type.value} model due to lower expected latency ({strong_model_latency:.2f}s vs {weak_model_latency:.2f}s)"
 
         return {
             "query": query,
             "predicted_semantic": None,
-            "model": self.models[model_type].name,
+            "model": models[model_type].name,
             "model_type": model_type,
             "optimization_metric": optimization_metric,
             "based_on": based_on,
         }
     
-    def _route_based_on_semantic(self, query: str) -> dict:
+    def _route_based_on_semantic(self, query: str, query_embeddings: QueryEmbeddings, models: Dict[str, LLM]) -> dict:
         
         # try to identify query type through semantic-router
-        semantic_route_choice = self.semantic_router_layer(query)
+        encoder = self.semantic_router_layer.encoder
+        vector = query_embeddings.get(encoder.name, lambda text: encoder([text])[0])
+        semantic_route_choice = self.semantic_router_layer(text=query, vector=vector)
         if semantic_route_choice.name is None:
             return {
                 "query": query,
@@ -114,28 +300,27 @@ class LLMRouter:
         return {
             "query": query,
             "predicted_semantic": semantic_route.name,
-            "model": self.models[model_type].name,
+            "model": models[model_type].name,
             "model_type": model_type,
             "optimization_metric": None,
             "based_on": f"Semantic: {semantic_route.name}",
         }
     
-    def _route_query_based_on_difficulty(self, query: str) -> dict:
-        model = self.routellm_controller._get_routed_model_for_completion(
-            messages=[{"role": "user", "content": query}],
-            
-            # matrix factorization model for router, for more options and details see https://github.com/lm-sys/RouteLLM?tab=readme-ov-file#routers
-            router="mf",
+    def _route_query_based_on_difficulty(self, query: str, query_embeddings: QueryEmbeddings, models: Dict[str, LLM]) -> dict:
 
-            # calibrated threshold to route approximately 50% of the queries to the strong model, for more details see https://github.com/lm-sys/RouteLLM?tab=readme-ov-file#threshold-calibration
-            threshold=0.11593,  
-        )
+        # matrix factorization model for router, for more options and details see https://github.com/lm-sys/RouteLLM?tab=readme-ov-file#routers
+        mf_router = self.routellm_controller.routers[ROUTELLM_ROUTER]
+        embedding_model_name = mf_router.model.embedding_model_name
+        vector = query_embeddings.get(embedding_model_name, openai_embed(embedding_model_name))
+
+        strong_win_rate = _mf_strong_win_rates(mf_router, [vector])[0]
+        model_type = LLMType.STRONG if strong_win_rate >= ROUTELLM_MF_THRESHOLD else LLMType.WEAK
 
         return {
             "query": query,
             "predicted_semantic": None,
-            "model": model,
-            "model_type": LLMType.STRONG if model == self.models["strong"].name else LLMType.WEAK,
+            "model": models[model_type].name,
+            "model_type": model_type,
             "optimization_metric": None,
             "based_on": "difficulty",
         }
@@ -144,40 +329,347 @@ class LLMRouter:
         self,
         query: str,
         optimization_metric: Optional[OptimizationMetric] = None,
+        query_embeddings: Optional[QueryEmbeddings] = None,
+        models: Optional[Dict[str, LLM]] = None,
     ) -> dict:
         # TODO: add routing decision to return (eg optimization metric, semantic route, or difficulty)
 
+        # route among the models active at the start of the request (callers completing the query pass theirs)
+        if models is None:
+            models = self.models
+
+        # embeddings of the query are shared between the semantic and difficulty routers (and the caller, if provided)
+        if query_embeddings is None:
+            query_embeddings = QueryEmbeddings(query)
+
         # First try to route based on optimization factor (if provided, valid and not 'availability')
         if (optimization_metric is not None) and (optimization_metric in OptimizationMetric) and (optimization_metric != OptimizationMetric.AVAILABILITY):
-            return self._route_based_on_optimization_metric(query, optimization_metric)
+            return self._route_based_on_optimization_metric(query, optimization_metric, models)
+
+        # Reuse the decision for a recently routed query (same text up to case and whitespace, same models)
+        cache_key = self._get_routing_cache_key(query, optimization_metric, models)
+        if (routing_decision := self.routing_cache.get(cache_key)) is not None:
+            return routing_decision | {"query": query, "based_on": f"{routing_decision['based_on']} (cached)"}
+
+        routing_decision = self._route_based_on_query(query, query_embeddings, models)
+        self.routing_cache.set(cache_key, routing_decision.copy())
+        return routing_decision
+
+    def _get_routing_cache_key(self, query: str, optimization_metric: Optional[OptimizationMetric], models: Dict[str, LLM]) -> tuple:
+        return (" ".join(query.casefold().split()), optimization_metric, models["strong"].name, models["weak"].name)
+
+    def _route_based_on_query(self, query: str, query_embeddings: QueryEmbeddings, models: Dict[str, LLM]) -> dict:
 
         # Secondly try to route based on query semantics
         if self.semantic_routes and self.semantic_router_layer:
-            routing_decision = self._route_based_on_semantic(query)
+            routing_decision = self._route_based_on_semantic(query, query_embeddings, models)
             if routing_decision["predicted_semantic"] is not None:
                 return routing_decision
             
         # Lastly, if unable to identify query type, find out whether to use strong or weak model using RouteLLM
-        return self._route_query_based_on_difficulty(query)
+        return self._route_query_based_on_difficulty(query, query_embeddings, models)
     
     
-    def completion(self, *, optimization_metric: Optional[OptimizationMetric] = None, **kwargs):
+    def route_queries(
+        self,
+        queries: List[str],
+        optimization_metric: Optional[OptimizationMetric] = None,
+        batch_size: int = ROUTING_BATCH_SIZE,
+    ) -> List[RoutingDecision]:
+        '''
+        Routes many queries at once (eg for analytics or pre-routing queued jobs). Same decisions as `route_query`,
+        but distinct queries are embedded in batches and scored by the difficulty router in a single vectorized pass.
+        '''
+        models = self.models
+
+        if (optimization_metric is not None) and (optimization_metric in OptimizationMetric) and (optimization_metric != OptimizationMetric.AVAILABILITY):
+            return [RoutingDecision.from_dict(self._route_based_on_optimization_metric(query, optimization_metric, models)) for query in queries]
+
+        # route each distinct query (up to case and whitespace) once, reusing cached decisions
+        decisions = {}
+        pending = {}
+        for query in queries:
+            cache_key = self._get_routing_cache_key(query, optimization_metric, models)
+            if cache_key in decisions or cache_key in pending:
+                continue
+            if (routing_decision := self.routing_cache.get(cache_key)) is not None:
+                decisions[cache_key] = routing_decision | {"based_on": f"{routing_decision['based_on']} (cached)"}
+            else:
+                pending[cache_key] = QueryEmbeddings(query)
+
+        def embed_in_batches(query_embeddings: List[QueryEmbeddings], model_name: str, embed_batch):
+            query_embeddings = [embeddings for embeddings in query_embeddings if model_name not in embeddings.models]
+            for i in range(0, len(query_embeddings), batch_size):
+                batch = query_embeddings[i:i + batch_size]
+                for embeddings, vector in zip(batch, embed_batch([embeddings.query for embeddings in batch])):
+                    embeddings.set(model_name, vector)
+
+        # Secondly try to route based on query semantics
+        if self.semantic_routes and self.semantic_router_layer:
+            encoder = self.semantic_router_layer.encoder
+            embed_in_batches(list(pending.values()), encoder.name, encoder)
+            for cache_key, query_embeddings in list(pending.items()):
+                routing_decision = self._route_based_on_semantic(query_embeddings.query, query_embeddings, models)
+                if routing_decision["predicted_semantic"] is not None:
+                    decisions[cache_key] = routing_decision
+                    del pending[cache_key]
+
+        # Lastly score the remaining queries' difficulty with RouteLLM
+        if pending:
+            mf_router = self.routellm_controller.routers[ROUTELLM_ROUTER]
+            embedding_model_name = mf_router.model.embedding_model_name
+            embed_in_batches(list(pending.values()), embedding_model_name, openai_embed_batch(embedding_model_name))
+
+            vectors = [query_embeddings.get(embedding_model_name) for query_embeddings in pending.values()]
+            strong_win_rates = _mf_strong_win_rates(mf_router, vectors)
+            for (cache_key, query_embeddings), strong_win_rate in zip(pending.items(), strong_win_rates):
+                model_type = LLMType.STRONG if strong_win_rate >= ROUTELLM_MF_THRESHOLD else LLMType.WEAK
+                decisions[cache_key] = {
+                    "query": query_embeddings.query,
+                    "predicted_semantic": None,
+                    "model": models[model_type].name,
+                    "model_type": model_type,
+                    "optimization_metric": None,
+                    "based_on": "difficulty",
+                }
+
+        for cache_key, routing_decision in decisions.items():
+            if not routing_decision["based_on"].endswith("(cached)"):
+                self.routing_cache.set(cache_key, routing_decision.copy())
+
+        return [
+            RoutingDecision.from_dict(decisions[self._get_routing_cache_key(query, optimization_metric, models)] | {"query": query})
+            for query in queries
+        ]
+
+    def _get_completion_kwargs(self, model: LLM, kwargs: dict) -> dict:
+        completion_kwargs = {key: value for key, value in kwargs.items() if key != "messages_by_model"}
+        # callers that fit the prompt to each model's budget pass one prompt per model name, the fallback or
+        # hedge model gets its own
+        if model.name in kwargs.get("messages_by_model", {}):
+            completion_kwargs["messages"] = kwargs["messages_by_model"][model.name]
+        return completion_kwargs | {
+            "model": model.model,
+            "api_base": model.api_base,
+            "api_key": model.api_key,
+        }
+
+    def _fallback(self, routing_decision: dict, models: Dict[str, LLM], reason: str) -> LLM:
+        '''
+        Updates the routing decision to the other model (of the one it routed to) and returns that model,
+        raises `CircuitOpenError` if the other model's circuit is open too
+        '''
+        preferred_model_type = routing_decision["model_type"]
+        fallback_model_type = LLMType.WEAK if preferred_model_type == LLMType.STRONG else LLMType.STRONG
+        fallback_model = models[fallback_model_type]
+
+        if not circuit_breakers.allow_request(fallback_model.name):
+            raise CircuitOpenError(f"{models[preferred_model_type]} ({reason}) and its fallback {fallback_model} are unavailable")
+
+        routing_decision.update({
+            "model": fallback_model.name,
+            "model_type": fallback_model_type,
+            "based_on": f"{routing_decision['based_on']} ({reason})"
+        })
+        return fallback_model
+
+    def _select_available_model(self, routing_decision: dict, models: Dict[str, LLM]) -> LLM:
+        '''
+        Returns the routed model, or the other one if the routed model's circuit is open
+        '''
+        preferred_model = models[routing_decision["model_type"]]
+        if circuit_breakers.allow_request(preferred_model.name):
+            return preferred_model
+        return self._fallback(routing_decision, models, "preferred model circuit open")
+
+    def _measured_completion(self, model: LLM, kwargs: dict):
+        '''
+        Calls the model and records its latency, time to first token (when streaming), throughput and errors
+        '''
+        start = time.perf_counter()
+        try:
+            response = completion(**self._get_completion_kwargs(model, kwargs))
+        except Exception:
+            telemetry.record_error(model.name)
+            circuit_breakers.record_failure(model.name)
+            raise
+
+        if kwargs.get("stream"):
+            return self._measured_stream(model, response, start)
+
+        telemetry.record_success(model.name, time.perf_counter() - start, completion_tokens=response.usage.completion_tokens)
+        circuit_breakers.record_success(model.name)
+        return response
+
+    def _measured_stream(self, model: LLM, stream, start: float):
+        ttft, completion_tokens = None, 0
+        try:
+            for chunk in stream:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                if chunk.choices and chunk.choices[0].delta.content:
+                    completion_tokens += 1  # a content chunk carries about one token
+                yield chunk
+        except Exception:
+            telemetry.record_error(model.name)
+            circuit_breakers.record_failure(model.name)
+            raise
+        finally:
+            # release the connection of a stream that is not read to the end (eg the loser of a hedged request)
+            if hasattr(stream, "close"):
+                stream.close()
+        telemetry.record_success(model.name, time.perf_counter() - start, ttft, completion_tokens)
+        circuit_breakers.record_success(model.name)
+
+    async def _ameasured_completion(self, model: LLM, kwargs: dict):
+        '''
+        Async variant of `_measured_completion`
+        '''
+        start = time.perf_counter()
+        try:
+            response = await acompletion(**self._get_completion_kwargs(model, kwargs))
+        except Exception:
+            telemetry.record_error(model.name)
+            circuit_breakers.record_failure(model.name)
+            raise
+
+        if kwargs.get("stream"):
+            return self._ameasured_stream(model, response, start)
+
+        telemetry.record_success(model.name, time.perf_counter() - start, completion_tokens=response.usage.completion_tokens)
+        circuit_breakers.record_success(model.name)
+        return response
+
+    async def _ameasured_stream(self, model: LLM, stream, start: float):
+        ttft, completion_tokens = None, 0
+        try:
+            async for chunk in stream:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                if chunk.choices and chunk.choices[0].delta.content:
+                    completion_tokens += 1
+                yield chunk
+        except Exception:
+            telemetry.record_error(model.name)
+            circuit_breakers.record_failure(model.name)
+            raise
+        finally:
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+        telemetry.record_success(model.name, time.perf_counter() - start, ttft, completion_tokens)
+        circuit_breakers.record_success(model.name)
+
+    def _get_hedge_delay(self, model: LLM, stream: bool) -> float:
+        '''
+        Seconds to wait for the preferred model before hedging: the configured quantile of its observed time to
+        first token (streams) or latency, or the configured delay while it has no observations
+        '''
+        if self.hedge_quantile is not None:
+            quantile = telemetry.ttft_quantile if stream else telemetry.latency_quantile
+            if (observed := quantile(model.name, self.hedge_quantile)) is not None:
+                return observed
+        return self.hedge_delay
+
+    @staticmethod
+    def _get_hedge_reason(done: set, hedge_delay: float) -> Optional[str]:
+        '''
+        Why the other model is asked too, given the preferred model's attempt if it is done after the hedge delay:
+        it timed out or failed. None if it answered.
+        '''
+        if not done:
+            return f"no answer from preferred model after {hedge_delay:.2f}s"
+        if (error := next(iter(done)).exception()) is not None:
+            return f"preferred model failed: {type(error).__name__}"
+        return None
+
+    def _record_hedge(self, routing_decision: dict, models: Dict[str, LLM], hedge_delay: float, winner: Optional[str], reason: Optional[str]):
+        '''
+        Records the outcome of a hedged request in the routing decision: the hedge delay and, if the other model was
+        called too, why and which of the two answered ("preferred" or "hedge")
+        '''
+        routing_decision.update({"hedge_delay": hedge_delay, "hedge_winner": winner, "hedge_reason": reason})
+        if winner == "hedge":
+            hedge_model_type = LLMType.WEAK if routing_decision["model_type"] == LLMType.STRONG else LLMType.STRONG
+            routing_decision.update({
+                "model": models[hedge_model_type].name,
+                "model_type": hedge_model_type,
+                "based_on": f"{routing_decision['based_on']} (hedged, {reason})",
+            })
+
+    def _first_response(self, model: LLM, kwargs: dict):
+        '''
+        Completion of the model that returns once it has answered, ie for streams once the first chunk arrived
+        '''
+        response = self._measured_completion(model, kwargs)
+        if not kwargs.get("stream"):
+            return response
+
+        first_chunk = next(response, None)
+        return response if first_chunk is None else PrependedStream(first_chunk, response)
+
+    def _hedged_completion(self, routing_decision: dict, models: Dict[str, LLM], kwargs: dict):
+        '''
+        Sends the request to the preferred model and, if it has not answered within the hedge delay (or failed),
+        to the other model too. Returns the first successful answer, the other one is discarded: a call already
+        running in a thread can not be interrupted, use the async variant for real cancellation.
+        '''
+        preferred_model = models[routing_decision["model_type"]]
+        hedge_model = models[LLMType.WEAK if routing_decision["model_type"] == LLMType.STRONG else LLMType.STRONG]
+        hedge_delay = self._get_hedge_delay(preferred_model, kwargs.get("stream", False))
+
+        attempts = {self._hedge_executor.submit(self._first_response, preferred_model, kwargs): "preferred"}
+        done, _ = wait(attempts, timeout=hedge_delay)
+        hedge_reason = self._get_hedge_reason(done, hedge_delay)
+        if hedge_reason is not None and circuit_breakers.allow_request(hedge_model.name):
+            print(f"Hedging {preferred_model} with {hedge_model}: {hedge_reason}...")
+            attempts[self._hedge_executor.submit(self._first_response, hedge_model, kwargs)] = "hedge"
+
+        winner, error, pending = None, None, set(attempts)
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None:
+                    winner = winner or attempt
+                else:
+                    error = attempt.exception()
+
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancel()
+                attempt.add_done_callback(self._discard)
+        if winner is None:
+            raise error
+
+        hedged = len(attempts) > 1
+        self._record_hedge(routing_decision, models, hedge_delay, attempts[winner] if hedged else None, hedge_reason if hedged else None)
+        return winner.result()
+
+    @staticmethod
+    def _discard(attempt):
+        # close the stream of a losing attempt (and the litellm stream it reads) so that its connection is released
+        if not attempt.cancelled() and attempt.exception() is None and hasattr(attempt.result(), "close"):
+            attempt.result().close()
+
+    def _routed_completion(self, optimization_metric: Optional[OptimizationMetric], query_embeddings: Optional[QueryEmbeddings], kwargs: dict,
+                           routing_decision: Optional[dict] = None, models: Optional[Dict[str, LLM]] = None):
 
         query = kwargs.get("messages")[-1]["content"]
-        routing_decision = self.route_query(query, optimization_metric)
+        # callers that route first (eg to fit the prompt to the model) pass their routing decision and the models
+        # it was made with, as `update_models` may have replaced them since
+        models = models or self.models
+        if routing_decision is None:
+            routing_decision = self.route_query(query, optimization_metric, query_embeddings, models)
         
-        preferred_model = self.models[routing_decision["model_type"]]
-        kwargs.update({
-            "model": preferred_model.model,
-            "api_base": preferred_model.api_base,
-            "api_key": preferred_model.api_key,
-        })
+        # skip a model whose circuit is open, whatever the optimization metric
+        preferred_model = self._select_available_model(routing_decision, models)
         print(f"Routed Model: {preferred_model}")    
 
+        # race the preferred model against the other one to bound tail latency
+        if optimization_metric == OptimizationMetric.AVAILABILITY and self.hedge_delay is not None:
+            return routing_decision, self._hedged_completion(routing_decision, models, kwargs)
+
         try:
-            response = completion(**kwargs)
-            response["_hidden_params"]["routing_decision"] = routing_decision
-            return response
+            return routing_decision, self._measured_completion(preferred_model, kwargs)
         
         # Fall back to the other model if availibility is the optimization metric
         except Exception as error:
@@ -187,27 +679,130 @@ class LLMRouter:
                 raise error
             
             # fallback to the other model to improve availability
-            preferred_model_type = routing_decision["model_type"]
-            fallback_model_type = LLMType.WEAK if preferred_model_type == LLMType.STRONG else LLMType.STRONG
-            fallback_model = self.models[fallback_model_type]
-            kwargs.update({
-                "model": fallback_model.model,
-                "api_base": fallback_model.api_base,
-                "api_key": fallback_model.api_key,
-            })
+            fallback_model = self._fallback(routing_decision, models, "preferred model failed")
             print(f"Error in completion with preferred model {preferred_model}, falling back to {fallback_model}...")
-            
-            # update routing decision
-            routing_decision.update({
-                "model": fallback_model,
-                "model_type": fallback_model_type,
-                "based_on": f"Optimization Metric: {optimization_metric} (preferred model failed)"
-            })
 
-            response = completion(**kwargs)
-            response["_hidden_params"]["routing_decision"] = routing_decision
+            return routing_decision, self._measured_completion(fallback_model, kwargs)
+
+    def completion(self, *, optimization_metric: Optional[OptimizationMetric] = None, query_embeddings: Optional[QueryEmbeddings] = None, routing_decision: Optional[dict] = None,
+                   models: Optional[Dict[str, LLM]] = None, **kwargs):
+        routing_decision, response = self._routed_completion(optimization_metric, query_embeddings, kwargs, routing_decision, models)
+        response["_hidden_params"]["routing_decision"] = routing_decision
+        return response
+
+    def stream_completion(self, *, optimization_metric: Optional[OptimizationMetric] = None, query_embeddings: Optional[QueryEmbeddings] = None, routing_decision: Optional[dict] = None,
+                          models: Optional[Dict[str, LLM]] = None, **kwargs):
+        '''
+        Streaming variant of `completion`, returns the routing decision (known before the first token) and
+        the litellm stream of response chunks
+        '''
+        return self._routed_completion(optimization_metric, query_embeddings, kwargs | {"stream": True}, routing_decision, models)
+
+    def model_completion(self, model_type: LLMType, **kwargs):
+        '''
+        Calls one of the current models directly, without routing (eg the weak model for background tasks),
+        raises CircuitOpenError if its circuit is open
+        '''
+        model = self.models[model_type]
+        if not circuit_breakers.allow_request(model.name):
+            raise CircuitOpenError(f"{model} is unavailable")
+        return self._measured_completion(model, kwargs)
+
+    async def _afirst_response(self, model: LLM, kwargs: dict):
+        '''
+        Async variant of `_first_response`
+        '''
+        response = await self._ameasured_completion(model, kwargs)
+        if not kwargs.get("stream"):
             return response
 
+        first_chunk = await anext(response, None)
+        return response if first_chunk is None else AsyncPrependedStream(first_chunk, response)
+
+    async def _ahedged_completion(self, routing_decision: dict, models: Dict[str, LLM], kwargs: dict):
+        '''
+        Async variant of `_hedged_completion`, the losing request is cancelled
+        '''
+        preferred_model = models[routing_decision["model_type"]]
+        hedge_model = models[LLMType.WEAK if routing_decision["model_type"] == LLMType.STRONG else LLMType.STRONG]
+        hedge_delay = self._get_hedge_delay(preferred_model, kwargs.get("stream", False))
+
+        attempts = {asyncio.create_task(self._afirst_response(preferred_model, kwargs)): "preferred"}
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=hedge_delay)
+            hedge_reason = self._get_hedge_reason(done, hedge_delay)
+            if hedge_reason is not None and circuit_breakers.allow_request(hedge_model.name):
+                print(f"Hedging {preferred_model} with {hedge_model}: {hedge_reason}...")
+                attempts[asyncio.create_task(self._afirst_response(hedge_model, kwargs))] = "hedge"
+
+            winner, error, pending = None, None, set(attempts)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        winner = winner or attempt
+                    else:
+                        error = attempt.exception()
+        finally:
+            # cancel the loser (or both, if the caller was cancelled)
+            for attempt in attempts:
+                if not attempt.done():
+                    attempt.cancel()
+
+        for attempt in attempts:
+            if attempt is not winner and attempt.done() and not attempt.cancelled() and attempt.exception() is None and kwargs.get("stream"):
+                await attempt.result().aclose()
+        if winner is None:
+            raise error
+
+        hedged = len(attempts) > 1
+        self._record_hedge(routing_decision, models, hedge_delay, attempts[winner] if hedged else None, hedge_reason if hedged else None)
+        return winner.result()
+
+    async def _arouted_completion(self, optimization_metric: Optional[OptimizationMetric], query_embeddings: Optional[QueryEmbeddings], kwargs: dict,
+                                  routing_decision: Optional[dict] = None, models: Optional[Dict[str, LLM]] = None):
+
+        # routing embeds the query and runs the routers on the CPU, keep it off the event loop
+        query = kwargs.get("messages")[-1]["content"]
+        models = models or self.models
+        if routing_decision is None:
+            routing_decision = await asyncio.to_thread(self.route_query, query, optimization_metric, query_embeddings, models)
+
+        preferred_model = self._select_available_model(routing_decision, models)
+        print(f"Routed Model: {preferred_model}")
+
+        if optimization_metric == OptimizationMetric.AVAILABILITY and self.hedge_delay is not None:
+            return routing_decision, await self._ahedged_completion(routing_decision, models, kwargs)
+
+        try:
+            return routing_decision, await self._ameasured_completion(preferred_model, kwargs)
+
+        # Fall back to the other model if availibility is the optimization metric
+        except Exception as error:
+            if optimization_metric != OptimizationMetric.AVAILABILITY:
+                raise error
+
+            fallback_model = self._fallback(routing_decision, models, "preferred model failed")
+            print(f"Error in completion with preferred model {preferred_model}, falling back to {fallback_model}...")
+
+            return routing_decision, await self._ameasured_completion(fallback_model, kwargs)
+
+    async def acompletion(self, *, optimization_metric: Optional[OptimizationMetric] = None, query_embeddings: Optional[QueryEmbeddings] = None, routing_decision: Optional[dict] = None,
+                          models: Optional[Dict[str, LLM]] = None, **kwargs):
+        '''
+        Async variant of `completion` built on litellm's `acompletion`
+        '''
+        routing_decision, response = await self._arouted_completion(optimization_metric, query_embeddings, kwargs, routing_decision, models)
+        response["_hidden_params"]["routing_decision"] = routing_decision
+        return response
+
+    async def astream_completion(self, *, optimization_metric: Optional[OptimizationMetric] = None, query_embeddings: Optional[QueryEmbeddings] = None, routing_decision: Optional[dict] = None,
+                                 models: Optional[Dict[str, LLM]] = None, **kwargs):
+        '''
+        Async variant of `stream_completion`, the returned stream is iterated with `async for`
+        '''
+        return await self._arouted_completion(optimization_metric, query_embeddings, kwargs | {"stream": True}, routing_decision, models)
+
 
 if __name__ == '__main__':
     from app.constants import SEMANTIC_ROUTES
@@ -1,6 +1,6 @@
-import random
 from typing import Optional
 from app.enums import LLMName
+from app.utils.telemetry import telemetry
 
 
 class LLM:
@@ -22,14 +22,20 @@ class LLM:
         return self.name
 
     @property
-    def tokens_per_second(self):
+    def tokens_per_second(self) -> Optional[float]:
         '''
-        Simulates the number of tokens per second the LLM can process.
-        TODO: replace with logic to get actual TPS from the model.
+        Measured number of tokens per second the LLM generates after the first token (moving average over recent
+        streamed completions), None until it has streamed one.
         '''
-        min_tps = 20
-        max_tps = 500
-        return round(random.uniform(min_tps, max_tps), 2)
+        return telemetry.tokens_per_second(self.name)
+
+    @property
+    def expected_latency(self) -> Optional[float]:
+        '''
+        Measured seconds the LLM takes to answer, accounting for its time to first token, throughput and error rate
+        (see `ModelTelemetry.expected_latency`), None until it has completed a request.
+        '''
+        return telemetry.expected_latency(self.name)
     
 
 LLMs = {
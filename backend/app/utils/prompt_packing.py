@@ -0,0 +1,92 @@
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+from langchain_core.documents import Document
+from litellm import token_counter
+
+from app.utils.llms import LLM
+
+
+# tokens a chat message costs on top of its content (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(model: LLM, text: str) -> int:
+    '''
+    Number of tokens of the text with the model's tokenizer
+    '''
+    return token_counter(model=model.model, text=text)
+
+
+def get_token_count(token_counts: dict, model: LLM, text: str) -> int:
+    '''
+    Token count of a message's or chunk's text for the model, cached in its `token_counts` (model name -> count)
+    '''
+    if model.name not in token_counts:
+        token_counts[model.name] = count_tokens(model, text)
+    return token_counts[model.name]
+
+
+@dataclass
+class PackedPrompt:
+    context: str
+    history: List[dict]
+    context_chunks: int
+    prompt_tokens: int  # estimated, the system prompt and query included
+    updated_messages: List[dict] = field(default_factory=list)  # history messages whose token count was computed
+
+    def stats(self, budget: int, candidate_chunks: int, candidate_messages: int) -> dict:
+        return {
+            "prompt_tokens_budget": budget,
+            "prompt_tokens": self.prompt_tokens,
+            "history_messages": f"{len(self.history)}/{candidate_messages}",
+            "context_chunks": f"{self.context_chunks}/{candidate_chunks}",
+        }
+
+
+def pack_prompt(
+    model: LLM,
+    budget: int,
+    base_tokens: int,
+    docs_and_scores: List[Tuple[Document, float]],
+    history: List[dict],
+    history_share: float,
+) -> PackedPrompt:
+    '''
+    Selects the history messages and context chunks to send to the model within a prompt token budget.
+
+    `base_tokens` is the cost of the system prompt and the query, which are always sent. The most recent history
+    messages (whole, without gaps) take up to `history_share` of the rest, the most relevant chunks fill what is left.
+    History messages are dicts with their `role`, `content` and cached `token_counts`, chunks cache theirs in
+    their metadata.
+    '''
+    remaining = budget - base_tokens
+
+    packed_history, updated_messages = [], []
+    history_budget = int(remaining * history_share)
+    for message in reversed(history):
+        if model.name not in message["token_counts"]:
+            updated_messages.append(message)
+        tokens = get_token_count(message["token_counts"], model, message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if tokens > history_budget:
+            break
+        history_budget -= tokens
+        remaining -= tokens
+        packed_history.append(message)
+    packed_history.reverse()
+
+    chunks = []
+    for doc, _ in sorted(docs_and_scores, key=lambda doc_and_score: doc_and_score[1], reverse=True):
+        tokens = get_token_count(doc.metadata.setdefault("token_counts", {}), model, doc.page_content) + 1  # joining space
+        if tokens > remaining:
+            continue
+        remaining -= tokens
+        chunks.append(doc)
+
+    return PackedPrompt(
+        context=" ".join(doc.page_content for doc in chunks),
+        history=packed_history,
+        context_chunks=len(chunks),
+        prompt_tokens=budget - remaining,
+        updated_messages=updated_messages,
+    )
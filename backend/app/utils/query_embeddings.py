@@ -0,0 +1,69 @@
+import threading
+from typing import Callable, Dict, List, Optional
+
+from openai import OpenAI
+
+
+_openai_client: Optional[OpenAI] = None
+
+
+def _get_openai_client() -> OpenAI:
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = OpenAI()
+    return _openai_client
+
+
+def openai_embed(model_name: str) -> Callable[[str], List[float]]:
+    '''
+    Returns a function that embeds a single text with the given OpenAI embedding model
+    '''
+    def embed(text: str) -> List[float]:
+        return _get_openai_client().embeddings.create(input=[text], model=model_name).data[0].embedding
+
+    return embed
+
+
+def openai_embed_batch(model_name: str) -> Callable[[List[str]], List[List[float]]]:
+    '''
+    Returns a function that embeds a batch of texts with the given OpenAI embedding model
+    '''
+    def embed(texts: List[str]) -> List[List[float]]:
+        return [item.embedding for item in _get_openai_client().embeddings.create(input=texts, model=model_name).data]
+
+    return embed
+
+
+class QueryEmbeddings:
+    '''
+    Embeddings of a single user query, computed at most once per embedding model.
+
+    One instance is created per request and handed to every component that needs the query vector
+    (semantic router, difficulty router, vector DB search), so components using the same embedding model
+    share a single embedding call.
+    '''
+
+    def __init__(self, query: str):
+        self.query = query
+        self._vectors: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name: str, embed: Optional[Callable[[str], List[float]]] = None) -> List[float]:
+        '''
+        Returns the query embedding for `model_name`, computing it with `embed` (OpenAI by default) on first use
+        '''
+        with self._lock:
+            if model_name not in self._vectors:
+                self._vectors[model_name] = (embed or openai_embed(model_name))(self.query)
+            return self._vectors[model_name]
+
+    def set(self, model_name: str, vector: List[float]):
+        '''
+        Provides an embedding computed elsewhere (eg in a batch with other queries)
+        '''
+        with self._lock:
+            self._vectors[model_name] = vector
+
+    @property
+    def models(self) -> List[str]:
+        return list(self._vectors)
@@ -0,0 +1,82 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class ResponseCache:
+    '''
+    Per chat cache of AI responses, looked up by query similarity.
+
+    A cached response is returned for a query whose embedding is within `similarity_threshold` (cosine) of a
+    previously answered query, provided the context retrieved from the knowledgebase for both is the same.
+    Entries expire after `ttl` seconds and each chat keeps at most `max_entries` of them (least recently used
+    ones are evicted).
+    '''
+
+    def __init__(self, max_entries: int, ttl: float, similarity_threshold: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._chats: Dict[int, "OrderedDict[int, dict]"] = {}
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    @staticmethod
+    def _context_key(context: str) -> str:
+        return hashlib.sha256(context.encode()).hexdigest()
+
+    def get(self, chat_id: int, query_vector: List[float], context: str) -> Optional[dict]:
+        '''
+        Returns the most similar cached response (with its `similarity` to the query), if any
+        '''
+        query_vector = self._normalize(query_vector)
+        context_key = self._context_key(context)
+        now = time.monotonic()
+
+        with self._lock:
+            entries = self._chats.get(chat_id)
+            if not entries:
+                return None
+
+            best_key, best_similarity = None, self.similarity_threshold
+            for key, entry in list(entries.items()):
+                if entry["expires_at"] < now:
+                    del entries[key]
+                    continue
+                if entry["context_key"] != context_key:
+                    continue
+                similarity = float(entry["query_vector"] @ query_vector)
+                if similarity >= best_similarity:
+                    best_key, best_similarity = key, similarity
+
+            if best_key is None:
+                return None
+
+            entries.move_to_end(best_key)
+            return entries[best_key]["response"] | {"similarity": best_similarity}
+
+    def set(self, chat_id: int, query_vector: List[float], context: str, response: dict):
+        with self._lock:
+            entries = self._chats.setdefault(chat_id, OrderedDict())
+            entries[self._next_key] = {
+                "query_vector": self._normalize(query_vector),
+                "context_key": self._context_key(context),
+                "expires_at": time.monotonic() + self.ttl,
+                "response": response,
+            }
+            self._next_key += 1
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def invalidate(self, chat_id: int):
+        with self._lock:
+            self._chats.pop(chat_id, None)
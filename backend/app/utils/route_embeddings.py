@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+from typing import List
+
+import numpy as np
+from semantic_router.encoders import BaseEncoder
+from semantic_router.layer import RouteLayer as SemanticRouteLayer
+
+from app.utils.semantic_route import SemanticRoute
+
+
+def _get_cache_key(encoder: BaseEncoder, routes: List[SemanticRoute]) -> str:
+    '''
+    Content hash of the encoder and the route utterances, changes whenever either does
+    '''
+    content = {
+        "encoder": [encoder.__class__.__name__, encoder.name, getattr(encoder, "dimensions", None)],
+        "routes": [[route.name, route.utterances] for route in routes],
+    }
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode()).hexdigest()
+
+
+def load_route_embeddings(encoder: BaseEncoder, routes: List[SemanticRoute], cache_dir: str) -> np.ndarray:
+    '''
+    Returns the embeddings of all route utterances (in route order). They are computed with the encoder only if no
+    cached embeddings exist for these utterances and encoder.
+    '''
+    path = os.path.join(cache_dir, f"{_get_cache_key(encoder, routes)}.npy")
+
+    if not os.path.exists(path):
+        utterances = [utterance for route in routes for utterance in route.utterances]
+        embeddings = np.asarray(encoder(utterances), dtype=np.float32)
+
+        # write to a temporary file first so that other workers never load a partially written array
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            np.save(file, embeddings)
+        os.replace(temp_path, path)
+
+    # not memory-mapped, the route layer's index copies the embeddings anyway
+    return np.load(path)
+
+
+def build_semantic_route_layer(encoder: BaseEncoder, routes: List[SemanticRoute], cache_dir: str) -> SemanticRouteLayer:
+    '''
+    Same as `SemanticRouteLayer(encoder=encoder, routes=routes)` but with the utterance embeddings loaded
+    from the on-disk cache instead of re-embedding every utterance. Fills the layer's routes and index like its
+    `_add_routes` does, which depends on the semantic-router version pinned in the requirements.
+    '''
+    layer = SemanticRouteLayer(encoder=encoder, routes=[])
+    if not routes:
+        return layer
+
+    embeddings = load_route_embeddings(encoder, routes, cache_dir)
+
+    layer.routes = list(routes)
+    for route in layer.routes:
+        if route.score_threshold is None:
+            route.score_threshold = layer.score_threshold
+
+    layer.index.add(
+        embeddings=embeddings,
+        routes=[route.name for route in routes for _ in route.utterances],
+        utterances=[utterance for route in routes for utterance in route.utterances],
+    )
+    return layer
@@ -1,64 +1,236 @@
-from typing import Any, List, Optional
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+import asyncio
 import json
+import threading
 
 import aiohttp
-from langchain_core.callbacks.manager import CallbackManagerForLLMRun
+from django.conf import settings
+from pydantic import Field
+from langchain_core.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
 from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
 
 
 
 class SelfHostedLLMInferenceClient:
+    '''
+    Client of a self-hosted (ollama) LLM server.
 
-    def __init__(self, base_url, api_key=None) -> None:
-        self.base_url = base_url
+    All requests go through one long-lived session (pooled keep-alive connections, so no TCP+TLS handshake per call)
+    running on the client's own event loop thread. The async methods can therefore be awaited from any event loop
+    and the sync ones called from any thread.
+    '''
+
+    def __init__(
+        self,
+        base_url,
+        api_key=None,
+        max_connections: int = 100,
+        max_connections_per_host: int = 10,
+        keepalive_timeout: float = 60,
+        connect_timeout: float = 5,
+        read_timeout: float = 60,
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = threading.Lock()
 
 
     def _get_request_headers(self) -> dict:
         headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
         return headers
 
 
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        '''
+        Returns the client's event loop, starting its thread on first use
+        '''
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="selfhostedllm-client", daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # only called on the client's loop, the session is bound to it
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, headers=self._get_request_headers())
+        return self._session
+
+    def _submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop())
+
+
+    def _get_payload(self, messages: List[dict], model_name: str, temperature: float, stream: bool, stop: Optional[List[str]] = None) -> dict:
+        options = {"temperature": temperature}
+        if stop:
+            options["stop"] = stop
+        return {
+            "model": model_name,
+            "messages": messages,
+            "options": options,
+            "stream": stream,
+        }
+
+    async def _chat(self, payload: dict) -> dict:
+        async with self._get_session().post(f"{self.base_url}/api/chat", json=payload) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def _stream_chat(self, payload: dict) -> AsyncIterator[dict]:
+        async with self._get_session().post(f"{self.base_url}/api/chat", json=payload) as response:
+            response.raise_for_status()
+
+            # ollama streams newline delimited JSON objects, the last one has "done": true
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+
+    def chat(self, messages: List[dict], model_name: str, temperature: float = 0.7, stop: Optional[List[str]] = None) -> dict:
+        '''
+        Returns ollama's `/api/chat` response (the reply is in `["message"]["content"]`)
+        '''
+        return self._submit(self._chat(self._get_payload(messages, model_name, temperature, False, stop))).result()
+
+    async def achat(self, messages: List[dict], model_name: str, temperature: float = 0.7, stop: Optional[List[str]] = None) -> dict:
+        return await asyncio.wrap_future(self._submit(self._chat(self._get_payload(messages, model_name, temperature, False, stop))))
+
+    def stream_chat(self, messages: List[dict], model_name: str, temperature: float = 0.7, stop: Optional[List[str]] = None) -> Iterator[dict]:
+        '''
+        Yields the chunks of ollama's streamed `/api/chat` response as they arrive
+        '''
+        chunks = self._stream_chat(self._get_payload(messages, model_name, temperature, True, stop))
+        try:
+            while True:
+                try:
+                    yield self._submit(chunks.__anext__()).result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            # releases the connection back to the pool if the caller stops early
+            self._submit(chunks.aclose()).result()
+
+    async def astream_chat(self, messages: List[dict], model_name: str, temperature: float = 0.7, stop: Optional[List[str]] = None) -> AsyncIterator[dict]:
+        chunks = self._stream_chat(self._get_payload(messages, model_name, temperature, True, stop))
+        try:
+            while True:
+                try:
+                    yield await asyncio.wrap_future(self._submit(chunks.__anext__()))
+                except StopAsyncIteration:
+                    return
+        finally:
+            await asyncio.wrap_future(self._submit(chunks.aclose()))
+
     async def generate_text(
         self, prompt: str, temperature: float, model_name: str
     ):
-        url = f"{self.base_url}/api/chat"
-        payload = {
-            "model": model_name,
-            "messages": [{"role": "user", "content": prompt}],
-            "options": {"temperature": temperature},
-            "stream": False,
-        }
+        response = await self.achat([{"role": "user", "content": prompt}], model_name, temperature)
+        return response.get("message", {}).get("content", "")
+
+    def close(self):
+        '''
+        Closes the pooled connections (a later request opens a new session)
+        '''
+        if self._loop is not None and self._session is not None:
+            self._submit(self._session.close()).result()
+
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url, json=payload, headers=self._get_request_headers()
-            ) as response:
-                if response.status == 200:
-                    json_response = await response.json()
-                    return json_response.get("message", {}).get("content", "")
-                else:
-                    response.raise_for_status()
+_default_inference_client: Optional[SelfHostedLLMInferenceClient] = None
+
+
+def get_default_inference_client() -> SelfHostedLLMInferenceClient:
+    '''
+    Returns the process' client of the self-hosted LLM server configured in settings, shared by every `LLMWrapper`
+    '''
+    global _default_inference_client
+    if _default_inference_client is None:
+        _default_inference_client = SelfHostedLLMInferenceClient(
+            base_url=settings.SELF_HOSTED_LLM_BASE_URL,
+            max_connections=settings.SELF_HOSTED_LLM_MAX_CONNECTIONS,
+            max_connections_per_host=settings.SELF_HOSTED_LLM_MAX_CONNECTIONS,
+            connect_timeout=settings.SELF_HOSTED_LLM_CONNECT_TIMEOUT,
+            read_timeout=settings.SELF_HOSTED_LLM_READ_TIMEOUT,
+        )
+    return _default_inference_client
 
 
 
 class LLMWrapper(LLM):
 
-    inference_client: SelfHostedLLMInferenceClient = (
-        SelfHostedLLMInferenceClient(base_url="https://llm.chatwards.ai")
-    )
+    inference_client: SelfHostedLLMInferenceClient = Field(default_factory=get_default_inference_client)
     temperature: float = 0.7
     model_name: str
 
+    @property
+    def _llm_type(self) -> str:
+        return "self-hosted-ollama"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"base_url": self.inference_client.base_url, "model_name": self.model_name, "temperature": self.temperature}
+
+    def _get_messages(self, prompt: str) -> List[dict]:
+        return [{"role": "user", "content": prompt}]
+
     def _call(
         self,
         prompt: str,
         stop: Optional[List[str]] = None,
         run_manager: Optional[CallbackManagerForLLMRun] = None,
         **kwargs: Any,
-    ):
-        return self.inference_client.generate_text(
-                prompt=prompt,
-                temperature=self.temperature,
-                model_name=self.model_name,
-            )
+    ) -> str:
+        response = self.inference_client.chat(self._get_messages(prompt), self.model_name, self.temperature, stop)
+        return response.get("message", {}).get("content", "")
 
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        response = await self.inference_client.achat(self._get_messages(prompt), self.model_name, self.temperature, stop)
+        return response.get("message", {}).get("content", "")
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        for chunk in self.inference_client.stream_chat(self._get_messages(prompt), self.model_name, self.temperature, stop):
+            generation_chunk = GenerationChunk(text=chunk.get("message", {}).get("content", ""))
+            if run_manager:
+                run_manager.on_llm_new_token(generation_chunk.text, chunk=generation_chunk)
+            yield generation_chunk
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        async for chunk in self.inference_client.astream_chat(self._get_messages(prompt), self.model_name, self.temperature, stop):
+            generation_chunk = GenerationChunk(text=chunk.get("message", {}).get("content", ""))
+            if run_manager:
+                await run_manager.on_llm_new_token(generation_chunk.text, chunk=generation_chunk)
+            yield generation_chunk
@@ -0,0 +1,95 @@
+import json
+import sqlite3
+import threading
+from collections.abc import Mapping
+from typing import Iterable, Iterator, List, Tuple, Union
+
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+
+class SQLiteDocstore(Docstore):
+    '''
+    Read-only docstore of the chunks of an index, kept in a SQLite file next to the FAISS index instead of a pickle.
+
+    Chunks are read on demand by their id (or index position, see `index_to_docstore_id`), so opening an index
+    does not load its texts and the file's pages are shared by all processes through the OS cache.
+    Index versions are written once and never modified (see `app.utils.index_store`), so the file is opened as
+    immutable (without locking) and stays readable after a newer version replaces and removes it.
+    '''
+
+    SCHEMA = "CREATE TABLE chunks (position INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+
+    def __init__(self, path: str):
+        self.path = path
+        # one connection shared by the request threads, the lookups are short
+        self._connection = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def query(self, sql: str, parameters: tuple = ()) -> list:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    @classmethod
+    def write(cls, path: str, chunks: Iterable[Tuple[int, str, Document]]):
+        '''
+        Creates the SQLite file of an index's chunks, given as (index position, id, document)
+        '''
+        connection = sqlite3.connect(path)
+        try:
+            connection.execute(cls.SCHEMA)
+            connection.executemany(
+                "INSERT INTO chunks (position, id, content, metadata) VALUES (?, ?, ?, ?)",
+                (
+                    (int(position), doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+                    for position, doc_id, doc in chunks
+                ),
+            )
+            connection.commit()
+        finally:
+            connection.close()
+
+    def search(self, search: str) -> Union[str, Document]:
+        rows = self.query("SELECT content, metadata FROM chunks WHERE id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        content, metadata = rows[0]
+        return Document(id=search, page_content=content, metadata=json.loads(metadata))
+
+    def iter_documents(self) -> Iterator[Tuple[int, str, Document]]:
+        '''
+        All chunks as (index position, id, document) in index order
+        '''
+        for position, doc_id, content, metadata in self.query("SELECT position, id, content, metadata FROM chunks ORDER BY position"):
+            yield position, doc_id, Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+
+    @property
+    def index_to_docstore_id(self) -> "SQLiteIndexToDocstoreId":
+        return SQLiteIndexToDocstoreId(self)
+
+
+class SQLiteIndexToDocstoreId(Mapping):
+    '''
+    Read-only `FAISS.index_to_docstore_id` mapping (index position -> chunk id) of a `SQLiteDocstore`
+    '''
+
+    def __init__(self, docstore: SQLiteDocstore):
+        self.docstore = docstore
+
+    def __getitem__(self, position: int) -> str:
+        rows = self.docstore.query("SELECT id FROM chunks WHERE position = ?", (int(position),))
+        if not rows:
+            raise KeyError(position)
+        return rows[0][0]
+
+    def __iter__(self) -> Iterator[int]:
+        return (position for position, in self.docstore.query("SELECT position FROM chunks ORDER BY position"))
+
+    def __len__(self) -> int:
+        return self.docstore.query("SELECT COUNT(*) FROM chunks")[0][0]
+
+    def items(self) -> List[Tuple[int, str]]:
+        return self.docstore.query("SELECT position, id FROM chunks ORDER BY position")
+
+    def values(self) -> List[str]:
+        return [doc_id for doc_id, in self.docstore.query("SELECT id FROM chunks ORDER BY position")]
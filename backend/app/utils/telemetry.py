@@ -0,0 +1,172 @@
+import math
+import threading
+from collections import defaultdict
+from typing import Dict, Optional
+
+
+class EWMA:
+    '''
+    Exponentially weighted moving average, recent samples weigh more
+    '''
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.value: Optional[float] = None
+
+    def update(self, sample: float):
+        self.value = sample if self.value is None else self.alpha * sample + (1 - self.alpha) * self.value
+
+
+class QuantileSketch:
+    '''
+    Log-bucketed histogram (DDSketch style) answering quantile queries with a bounded relative error.
+    Counts are halved once `max_count` samples are reached, so the quantiles follow recent behaviour.
+    '''
+
+    def __init__(self, relative_accuracy: float = 0.02, max_count: int = 10_000):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.max_count = max_count
+        self.buckets: Dict[int, float] = defaultdict(float)
+        self.count = 0.0
+
+    def add(self, value: float):
+        value = max(value, 1e-9)
+        self.buckets[math.ceil(math.log(value, self.gamma))] += 1
+        self.count += 1
+
+        if self.count >= self.max_count:
+            for key in self.buckets:
+                self.buckets[key] /= 2
+            self.count /= 2
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                break
+        # middle of the bucket (gamma^(key-1), gamma^key]
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+
+class ModelTelemetry:
+    '''
+    Measured time to first token, latency, throughput (tokens per second), answer length and error rate of a model
+    '''
+
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    # lowest success rate the expected latency accounts for, a model failing more often has its circuit opened anyway
+    MIN_SUCCESS_RATE = 0.1
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.ttft = EWMA()
+        self.latency = EWMA()
+        self.tokens_per_second = EWMA()  # generation throughput after the first token, measured on streams
+        self.end_to_end_tokens_per_second = EWMA()  # completion tokens over the whole latency, measured without streaming
+        self.completion_tokens = EWMA()
+        self.error_rate = EWMA(alpha=0.1)
+        self.ttft_sketch = QuantileSketch()
+        self.latency_sketch = QuantileSketch()
+
+    def record_success(self, latency: float, ttft: Optional[float] = None, completion_tokens: Optional[int] = None):
+        self.requests += 1
+        self.error_rate.update(0)
+        self.latency.update(latency)
+        self.latency_sketch.add(latency)
+
+        if ttft is not None:
+            self.ttft.update(ttft)
+            self.ttft_sketch.add(ttft)
+
+        if completion_tokens:
+            self.completion_tokens.update(completion_tokens)
+            # the generation throughput needs the time to first token, without it only the end-to-end one is known
+            if ttft is None:
+                self.end_to_end_tokens_per_second.update(completion_tokens / latency)
+            elif latency > ttft:
+                self.tokens_per_second.update(completion_tokens / (latency - ttft))
+
+    def record_error(self):
+        self.requests += 1
+        self.errors += 1
+        self.error_rate.update(1)
+
+    @property
+    def expected_latency(self) -> Optional[float]:
+        '''
+        Expected seconds to get an answer of the usual length: the time to first token plus its generation time (or
+        its end-to-end time, for a model only called without streaming), divided by the success rate as failed
+        requests have to be made again. None until the model has answered.
+        '''
+        if self.completion_tokens.value is None:
+            return None
+        if self.ttft.value is not None and self.tokens_per_second.value:
+            latency = self.ttft.value + self.completion_tokens.value / self.tokens_per_second.value
+        elif self.end_to_end_tokens_per_second.value:
+            latency = self.completion_tokens.value / self.end_to_end_tokens_per_second.value
+        else:
+            return None
+        return latency / max(1 - (self.error_rate.value or 0), self.MIN_SUCCESS_RATE)
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": self.error_rate.value,
+            "tokens_per_second": self.tokens_per_second.value,
+            "end_to_end_tokens_per_second": self.end_to_end_tokens_per_second.value,
+            "completion_tokens": self.completion_tokens.value,
+            "expected_latency": self.expected_latency,
+            "ttft": self.ttft.value,
+            "latency": self.latency.value,
+            "ttft_quantiles": {f"p{int(q * 100)}": self.ttft_sketch.quantile(q) for q in self.QUANTILES},
+            "latency_quantiles": {f"p{int(q * 100)}": self.latency_sketch.quantile(q) for q in self.QUANTILES},
+        }
+
+
+class Telemetry:
+    '''
+    Per-process telemetry of every model, keyed by model name
+    '''
+
+    def __init__(self):
+        self._models: Dict[str, ModelTelemetry] = defaultdict(ModelTelemetry)
+        self._lock = threading.Lock()
+
+    def record_success(self, model_name: str, latency: float, ttft: Optional[float] = None, completion_tokens: Optional[int] = None):
+        with self._lock:
+            self._models[model_name].record_success(latency, ttft, completion_tokens)
+
+    def record_error(self, model_name: str):
+        with self._lock:
+            self._models[model_name].record_error()
+
+    def tokens_per_second(self, model_name: str) -> Optional[float]:
+        with self._lock:
+            return self._models[model_name].tokens_per_second.value if model_name in self._models else None
+
+    def expected_latency(self, model_name: str) -> Optional[float]:
+        with self._lock:
+            return self._models[model_name].expected_latency if model_name in self._models else None
+
+    def latency_quantile(self, model_name: str, q: float) -> Optional[float]:
+        with self._lock:
+            return self._models[model_name].latency_sketch.quantile(q) if model_name in self._models else None
+
+    def ttft_quantile(self, model_name: str, q: float) -> Optional[float]:
+        with self._lock:
+            return self._models[model_name].ttft_sketch.quantile(q) if model_name in self._models else None
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {model_name: model.to_dict() for model_name, model in self._models.items()}
+
+
+telemetry = Telemetry()
@@ -1,18 +1,40 @@
+import base64
+import binascii
 import json
 import logging
 import os
+from datetime import datetime
 
-from django.http import JsonResponse
-from django.db import transaction
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
 
-from app.models import Chat, Message
-from app.utils.chat import get_models, update_models, create_index, get_ai_response
+from app.models import Chat, Message, MessagePayload
+from app.utils.chat import get_llm_router, get_models, update_models, warmup, aget_ai_response, astream_ai_response, add_to_index, delete_from_index, get_index_documents
+from app.utils.index_store import index_cache, get_index_report
+from app.utils.index_jobs import submit_index_job
+from app.utils.telemetry import telemetry
+from app.utils.circuit_breaker import CircuitOpenError, circuit_breakers
 from app.utils.llms import LLMs
-from app.enums import OptimizationMetric, LLMName
+from app.enums import OptimizationMetric, LLMName, IndexStatus, CircuitState
 
 # Initial setup
 logger = logging.getLogger(__name__)
-update_models()  # set default models
+
+DEFAULT_CHATS_PAGE_SIZE = 50
+MAX_CHATS_PAGE_SIZE = 200
+DEFAULT_MESSAGES_PAGE_SIZE = 50
+MAX_MESSAGES_PAGE_SIZE = 200
+EXPORT_CHUNK_SIZE = 500  # messages fetched from the database at once when exporting
+
+
+async def warmup_view(request):
+    '''
+    Builds the LLM router (semantic router layer, RouteLLM controller) if not built yet, for readiness probes
+    '''
+    timings = await sync_to_async(warmup, thread_sensitive=False)()
+    return JsonResponse({"status": "ready", "timings": timings})
 
 
 def example_view(request):
@@ -44,7 +66,55 @@ def models_info(request):
     return JsonResponse(get_models())
     
 
-def get_chat(request, chat_id):
+def index_cache_stats(request):
+    '''
+    Hit/miss/eviction counters of this process' vector index cache
+    '''
+    return JsonResponse(index_cache.stats())
+
+
+async def route_queries(request):
+    '''
+    Routes a batch of queries (JSON body with "queries" and an optional "optimization_metric") without
+    getting responses, eg for analytics or pre-routing queued jobs
+    '''
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST requests are allowed"}, status=405)
+
+    try:
+        request_data = json.loads(request.body)
+        queries = request_data.get("queries")
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            raise ValueError("queries must be a list of strings")
+
+        optimization_metric = request_data.get("optimization_metric")
+        if optimization_metric is not None:
+            optimization_metric = OptimizationMetric(optimization_metric)
+
+    except (AttributeError, ValueError, json.JSONDecodeError) as e:
+        return JsonResponse({"error": f"Invalid request. Error: {e}"}, status=400)
+
+    routing_decisions = await sync_to_async(get_llm_router().route_queries, thread_sensitive=False)(queries, optimization_metric)
+    return JsonResponse({"routing_decisions": [routing_decision.to_dict() for routing_decision in routing_decisions]})
+
+
+def model_telemetry(request):
+    '''
+    Measured time to first token, latency, tokens per second and error rate of each model (in this process)
+    '''
+    return JsonResponse({"models": telemetry.snapshot()})
+
+
+def health(request):
+    '''
+    Circuit breaker state of each model that has been called (in this process), "degraded" while any circuit is not closed
+    '''
+    models = circuit_breakers.snapshot()
+    status = "ok" if all(model["state"] == CircuitState.CLOSED for model in models.values()) else "degraded"
+    return JsonResponse({"status": status, "models": models})
+
+
+async def get_chat(request, chat_id):
     '''
     Retrieve a chat and its messages with detailed information
     '''
@@ -72,39 +142,119 @@ def get_chat(request, chat_id):
 
     try:
         chat_id = int(chat_id)
-        chat = Chat.objects.get(id=chat_id)
+        chat = await Chat.objects.aget(id=chat_id)
     except (ValueError, Chat.DoesNotExist):
         return JsonResponse({"error": "Invalid chat_id provided"}, status=400)
 
-    # get all messages in the chat and related information
-    messages = [
-        {
-            "content": message.content,
-            "role": message.role,
-            "model_used": message.model_used,
-            "predicted_semantic": message.predicted_semantic,
-            "metadata": message.metadata,
-            "sent_at": message.sent_at,
-        }
-        for message in chat.get_messages()
-    ]
+    # get a page of the chat's messages: the latest ones, or those before/after a message id
+    try:
+        limit = min(int(request.GET.get("limit", DEFAULT_MESSAGES_PAGE_SIZE)), MAX_MESSAGES_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        before = int(request.GET["before"]) if "before" in request.GET else None
+        after = int(request.GET["after"]) if "after" in request.GET else None
+    except ValueError as e:
+        return JsonResponse({"error": f"Invalid pagination parameters. Error: {e}"}, status=400)
+
+    include_metadata = request.GET.get("include_metadata", "false").lower() == "true"
 
-    return JsonResponse({"name": f"{chat.id} - {chat.name}", "messages": messages})
+    messages_query = chat.messages.all() if include_metadata else chat.messages.defer("metadata")
+    if before is not None:
+        messages_query = messages_query.filter(id__lt=before)
+    if after is not None:
+        messages_query = messages_query.filter(id__gt=after)
+
+    # page from the oldest message when paging forward (after), from the newest one otherwise, one extra tells if there are more
+    page = [message async for message in messages_query.order_by("id" if after is not None and before is None else "-id")[:limit + 1]]
+    has_more = len(page) > limit
+    page = sorted(page[:limit], key=lambda message: message.id)
+
+    messages = [message.serialize(include_metadata=include_metadata) for message in page]
+
+    return JsonResponse({"name": f"{chat.id} - {chat.name}", "index_status": chat.index_status, "messages": messages, "has_more": has_more})
+
+
+async def message_metadata(request, chat_id, message_id):
+    '''
+    Metadata of a single message (left out of the chat's messages by default) and, for AI messages, the raw
+    provider response
+    '''
+    try:
+        message = await Message.objects.only("id", "metadata").aget(id=message_id, chat_id=chat_id)
+    except (ValueError, Message.DoesNotExist):
+        return JsonResponse({"error": "Invalid chat_id or message_id provided"}, status=400)
+
+    payload = await MessagePayload.objects.filter(message_id=message.id).afirst()
+    return JsonResponse({"id": message.id, "metadata": message.metadata, "payload": payload.data if payload else None})
+
+
+async def export_chat(request, chat_id):
+    '''
+    The whole chat with all its messages (and their metadata) as a JSON file, streamed message by message
+    '''
+    try:
+        chat = await Chat.objects.aget(id=chat_id)
+    except Chat.DoesNotExist:
+        return JsonResponse({"error": "Invalid chat_id provided"}, status=400)
+
+    async def export():
+        yield '{"chat": ' + json.dumps({"id": chat.id, "name": chat.name, "started_at": chat.started_at}, cls=DjangoJSONEncoder, ensure_ascii=False) + ', "messages": ['
+        separator = ""
+        async for message in chat.messages.select_related("payload").order_by("id").aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+            payload = message.payload.data if hasattr(message, "payload") else None
+            yield separator + json.dumps(message.serialize() | {"payload": payload}, cls=DjangoJSONEncoder, ensure_ascii=False)
+            separator = ", "
+        yield "]}"
+
+    response = StreamingHttpResponse(export(), content_type="application/json")
+    response["Content-Disposition"] = f'attachment; filename="chat-{chat.id}.json"'
+    return response
+
+
+def _encode_chats_cursor(chat: Chat) -> str:
+    return base64.urlsafe_b64encode(json.dumps([chat.last_activity_at.isoformat(), chat.id]).encode()).decode()
+
+
+def _decode_chats_cursor(cursor: str) -> tuple:
+    try:
+        last_activity_at, chat_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError(f"malformed cursor ({e})")
+    return datetime.fromisoformat(last_activity_at), int(chat_id)
 
 
 def get_chats(request):
     '''
-    Retrieve all chats with basic info
+    Retrieve chats with basic info, most recently active first.
+    Paginated by cursor: pass the previous page's "next_cursor" as `cursor` (and optionally a `limit`) for the next page.
     '''
 
+    try:
+        limit = min(int(request.GET.get("limit", DEFAULT_CHATS_PAGE_SIZE)), MAX_CHATS_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+
+        chats_query = Chat.objects.only("id", "name", "started_at", "last_activity_at", "last_message_preview").order_by("-last_activity_at", "-id")
+        if cursor := request.GET.get("cursor"):
+            last_activity_at, chat_id = _decode_chats_cursor(cursor)
+            chats_query = chats_query.filter(Q(last_activity_at__lt=last_activity_at) | Q(last_activity_at=last_activity_at, id__lt=chat_id))
+
+    except (ValueError, TypeError) as e:
+        return JsonResponse({"error": f"Invalid pagination parameters. Error: {e}"}, status=400)
+
+    # one extra row tells whether there is a next page
+    page = list(chats_query[:limit + 1])
+    next_cursor = _encode_chats_cursor(page[limit - 1]) if len(page) > limit else None
+
     chats = [
         {
             "id": chat.id,
             "name": chat.name,
             "started_at": chat.started_at,
-            "last_message": chat.messages.last().content[:50] if chat.messages.last() else "",
+            "last_activity_at": chat.last_activity_at,
+            "last_message": chat.last_message_preview,
         }
-        for chat in Chat.objects.all()
+        for chat in page[:limit]
     ]
 
     # # mock
@@ -128,10 +278,10 @@ def get_chats(request):
     #         "last_message": "Hello, World!",
     #     },
     # ]
-    return JsonResponse({"chats": chats})
+    return JsonResponse({"chats": chats, "next_cursor": next_cursor})
 
 
-def create_chat(request):
+async def create_chat(request):
     if request.method != "POST":
         return JsonResponse({"error": "Only POST requests are allowed"}, status=405)
     
@@ -142,23 +292,85 @@ def create_chat(request):
     if not (knowledgebase := request.POST.get("knowledgebase")):
         return JsonResponse({"error": "No knowledgebase provided"}, status=400)
         
-    # attempt to create chat and index
-    try:
-        with transaction.atomic():
-            chat = Chat.objects.create(name=request.POST.get("name"))
-            create_index(knowledgebase.strip(), chat.id)
-    except Exception as e:
-        print(f"Error creating chat: {e}", flush=True)
-        return JsonResponse({"error": str(e)}, status=500)
+    # create chat and build its index in the background, clients poll the chat's index status until it is ready
+    chat = await Chat.objects.acreate(name=request.POST.get("name"), pending_knowledgebase=knowledgebase.strip())
+    submit_index_job(chat.pending_knowledgebase, chat.id)
     
     print(f"Chat created successfully: {chat.id}", flush=True)
-    return JsonResponse({"chat_id": chat.id, "message": "Chat created successfully"})
+    return JsonResponse({"chat_id": chat.id, "index_status": chat.index_status, "message": "Chat created successfully, indexing knowledgebase"}, status=202)
+
+
+async def index_status(request, chat_id):
+    '''
+    Status of the background job building a chat's index
+    '''
+    try:
+        chat = await Chat.objects.aget(id=int(chat_id))
+    except (ValueError, Chat.DoesNotExist):
+        return JsonResponse({"error": "Invalid chat_id provided"}, status=400)
+
+    # recall/latency of the built index per search setting, to pick `nprobe`/`ef_search` for queries
+    index_report = await sync_to_async(get_index_report)(chat.id) if chat.index_status == IndexStatus.READY else None
+
+    return JsonResponse({"chat_id": chat.id, "index_status": chat.index_status, "index_error": chat.index_error, "index_report": index_report})
     
 
 
+async def knowledgebase(request, chat_id):
+    '''
+    List (GET), append text to (POST) or delete documents by id from (DELETE) a chat's knowledgebase,
+    only the changed documents are embedded and the index is updated in place
+    '''
+    try:
+        chat = await Chat.objects.aget(id=int(chat_id))
+    except (ValueError, Chat.DoesNotExist):
+        return JsonResponse({"error": "Invalid chat_id provided"}, status=400)
+
+    if chat.index_status != IndexStatus.READY:
+        return JsonResponse({"error": "Index not ready", "index_status": chat.index_status, "index_error": chat.index_error}, status=409)
+
+    if request.method == "GET":
+        documents = await sync_to_async(get_index_documents, thread_sensitive=False)(chat.id)
+        return JsonResponse({"chat_id": chat.id, "documents": documents})
+
+    if request.method == "POST":
+        if not (text := request.POST.get("knowledgebase")):
+            return JsonResponse({"error": "No knowledgebase provided"}, status=400)
+
+        ids = await sync_to_async(add_to_index, thread_sensitive=False)(text.strip(), chat.id)
+        return JsonResponse({"chat_id": chat.id, "ids": ids, "message": f"Added {len(ids)} documents to knowledgebase"})
+
+    if request.method == "DELETE":
+        try:
+            ids = json.loads(request.body).get("ids")
+            if not ids or not isinstance(ids, list):
+                raise ValueError("No document ids provided")
+            await sync_to_async(delete_from_index, thread_sensitive=False)(ids, chat.id)
+        except (ValueError, AttributeError, json.JSONDecodeError) as e:
+            return JsonResponse({"error": f"Invalid document ids provided. Error: {e}"}, status=400)
+
+        return JsonResponse({"chat_id": chat.id, "ids": ids, "message": f"Deleted {len(ids)} documents from knowledgebase"})
+
+    return JsonResponse({"error": "Only GET, POST and DELETE requests are allowed"}, status=405)
+
+
+def _get_search_params(data) -> dict:
+    '''
+    Optional search depth of approximate indexes for a query: `nprobe` (IVF-PQ) and `ef_search` (HNSW),
+    raises ValueError if invalid
+    '''
+    search_params = {}
+    for name in ("nprobe", "ef_search"):
+        if data.get(name):
+            search_params[name] = int(data[name])
+            if search_params[name] < 1:
+                raise ValueError(f"{name} must be positive")
+    return search_params
+
+
 # route which gets chat id and user message, gets ai response does other necessary things and returns the response
 # path('chat/<int:chat_id>/get_ai_response/', views.get_ai_response, name='get_ai_response'),
-def ai_response(request, chat_id):
+async def ai_response(request, chat_id):
 
     if request.method != "POST":
         return JsonResponse({"error": "Only POST requests are allowed"}, status=405)
@@ -174,10 +386,13 @@ def ai_response(request, chat_id):
         
     try:
         chat_id = int(chat_id)
-        Chat.objects.get(id=chat_id)
+        chat = await Chat.objects.aget(id=chat_id)
     except (ValueError, Chat.DoesNotExist):
         return JsonResponse({"error": "Invalid chat_id provided"}, status=400)
 
+    if chat.index_status != IndexStatus.READY:
+        return JsonResponse({"error": "Index not ready", "index_status": chat.index_status, "index_error": chat.index_error}, status=409)
+
     query = request.POST.get("query")
     # return JsonResponse({
     #         "query": query,
@@ -187,10 +402,52 @@ def ai_response(request, chat_id):
     # check if optimization metric is provided and valid
     if (optimization_metric := request.POST.get("optimization_metric")) in OptimizationMetric:
         optimization_metric = OptimizationMetric(optimization_metric)  # enumerate
+
+    try:
+        search_params = _get_search_params(request.POST)
+    except ValueError as e:
+        return JsonResponse({"error": f"Invalid search parameters. Error: {e}"}, status=400)
         
-    ai_response_data = get_ai_response(query=query, chat_id=chat_id, optimization_metric=optimization_metric)
+    try:
+        ai_response_data = await aget_ai_response(query=query, chat_id=chat_id, optimization_metric=optimization_metric, search_params=search_params)
+    except CircuitOpenError as error:
+        return JsonResponse({"error": str(error)}, status=503)
 
     return JsonResponse(ai_response_data)
 
-    
-    
\ No newline at end of file
+
+async def ai_response_stream(request, chat_id):
+    '''
+    Same as `ai_response` but streams the response tokens as Server-Sent Events as they are generated
+    '''
+
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST requests are allowed"}, status=405)
+
+    try:
+        chat_id = int(chat_id)
+        chat = await Chat.objects.aget(id=chat_id)
+    except (ValueError, Chat.DoesNotExist):
+        return JsonResponse({"error": "Invalid chat_id provided"}, status=400)
+
+    if chat.index_status != IndexStatus.READY:
+        return JsonResponse({"error": "Index not ready", "index_status": chat.index_status, "index_error": chat.index_error}, status=409)
+
+    query = request.POST.get("query")
+
+    # check if optimization metric is provided and valid
+    if (optimization_metric := request.POST.get("optimization_metric")) in OptimizationMetric:
+        optimization_metric = OptimizationMetric(optimization_metric)  # enumerate
+
+    try:
+        search_params = _get_search_params(request.POST)
+    except ValueError as e:
+        return JsonResponse({"error": f"Invalid search parameters. Error: {e}"}, status=400)
+
+    response = StreamingHttpResponse(
+        astream_ai_response(query=query, chat_id=chat_id, optimization_metric=optimization_metric, search_params=search_params),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # disable proxy buffering so tokens reach the client immediately
+    return response
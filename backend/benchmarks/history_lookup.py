@@ -0,0 +1,81 @@
+'''
+Benchmarks the recent history lookup done for every AI response (`Chat.get_history`) against chat length.
+
+Runs against a throwaway test database (the configured database engine, with the "test_" name prefix), never
+the real one:
+
+    python benchmarks/history_lookup.py [--sizes 100 1000 10000 100000] [--repeat 200] [--k-recent 4]
+
+With the (chat, sent_at) index the lookup reads k index entries whatever the chat length, so the time per lookup
+should stay flat as chats grow. The query plan of the lookup is printed for the largest chat.
+'''
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "MultiLLMRoutingRAG.settings")
+
+import django
+
+django.setup()
+
+from django.db import connection
+
+from app.enums import Role
+from app.models import Chat, Message
+
+
+def create_chat(n_messages: int) -> Chat:
+    chat = Chat.objects.create(name=f"benchmark {n_messages}")
+    Message.objects.bulk_create(
+        (
+            Message(chat=chat, role=Role.USER.value if i % 2 == 0 else Role.ASSISTANT.value, content=f"message {i} " * 20,
+                    metadata={"padding": "x" * 512})
+            for i in range(n_messages)
+        ),
+        batch_size=5_000,
+    )
+    return chat
+
+
+def time_lookup(chat: Chat, k_recent: int, repeat: int) -> float:
+    '''
+    Median seconds per `get_history` call
+    '''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chat.get_history(k_recent)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 10_000, 100_000], help="messages per chat")
+    parser.add_argument("--repeat", type=int, default=200, help="lookups timed per chat")
+    parser.add_argument("--k-recent", type=int, default=4, help="history length")
+    args = parser.parse_args()
+
+    test_database_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        print(f"Test database: {test_database_name}\n")
+        print(f"{'messages':>10}  {'median lookup (ms)':>18}")
+
+        chat = None
+        for size in args.sizes:
+            chat = create_chat(size)
+            print(f"{size:>10}  {time_lookup(chat, args.k_recent, args.repeat) * 1000:>18.3f}")
+
+        if chat is not None:
+            print("\nQuery plan:")
+            print(chat.messages.order_by("-sent_at").values("role", "content")[:args.k_recent].explain())
+    finally:
+        connection.creation.destroy_test_db(test_database_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,5 +10,11 @@ python manage.py collectstatic --noinput
 python manage.py makemigrations
 python manage.py migrate
 
+# Convert chat indexes with a pickled docstore to the memory-mapped format
+python manage.py convert_indexes
+
+# Precompute semantic route embeddings and fetch the RouteLLM checkpoint once for all workers
+python manage.py warmup
+
 # Start the server
 exec "$@"
@@ -51,6 +51,17 @@ function message_component(message) {
     let containerDiv = document.createElement('div');
     containerDiv.className = `message ${message.role}`;
     containerDiv.addEventListener('click', () => {
+        // chat history is loaded without metadata, fetch it on first click
+        if (message.metadata === undefined && message.id !== undefined) {
+            fetch(`/api/chat/${message.chat_id}/messages/${message.id}/metadata/`)
+                .then(response => response.json())
+                .then(data => {
+                    message.metadata = data.metadata;
+                    show_message_metadata(JSON.stringify(message, null, 4));
+                })
+                .catch(error => console.error('Error:', error));
+            return;
+        }
         show_message_metadata(JSON.stringify(message, null, 4));
     }
     );
@@ -255,6 +266,9 @@ function load_chat(chat_id) {
             chat_id_field.value = chat_id;
 
             chat_messages.scrollTop = chat_messages.scrollHeight;
+
+            // messages can only be sent once the chat's index is ready
+            wait_for_index(chat_id);
         }
         )
         .catch(error => {
@@ -265,6 +279,54 @@ function load_chat(chat_id) {
 
 }
 
+// the message form is disabled while a chat's index is built in the background
+const index_status_poll_interval = 2000;
+
+function set_message_form_enabled(enabled, placeholder = 'Type your message...') {
+    const form = document.getElementById('new-message-form');
+    form.querySelector('textarea[name="new-message"]').disabled = !enabled;
+    form.querySelector('textarea[name="new-message"]').placeholder = placeholder;
+    form.querySelector('button[type="submit"]').disabled = !enabled;
+}
+
+function wait_for_index(chat_id) {
+    const url = `/api/chat/${chat_id}/index_status/`;
+    const chat_id_field = document.querySelector('#chat-interface input[name="chat-id"]');
+
+    fetch(url)
+        .then(response => {
+            if (!response.ok) {
+                return response.json().then(errorData => {
+                    throw new Error(`Error ${response.status}: ${errorData.error || response.statusText}`);
+                });
+            }
+
+            return response.json();
+        })
+        .then(data => {
+            console.log('Index status:', data);
+
+            // another chat was loaded meanwhile
+            if (chat_id_field.value !== String(chat_id)) {
+                return;
+            }
+
+            if (data.index_status === 'ready') {
+                set_message_form_enabled(true);
+            } else if (data.index_status === 'failed') {
+                set_message_form_enabled(false, 'The knowledge base of this chat could not be indexed.');
+                alert(`The knowledge base of this chat could not be indexed: ${data.index_error}`);
+            } else {
+                set_message_form_enabled(false, 'Indexing the knowledge base, please wait...');
+                setTimeout(() => wait_for_index(chat_id), index_status_poll_interval);
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            set_message_form_enabled(true);
+        });
+}
+
 function create_new_chat(event) {
     event.preventDefault();
 
@@ -313,7 +375,7 @@ function create_new_chat(event) {
             form.querySelector('input[name="new-chat-name"]').value = '';
             form.querySelector('textarea[name="new-chat-knowledgebase"]').value = '';
 
-            // load new chat and update chats list
+            // load new chat (its index is built in the background, see `wait_for_index`) and update chats list
             load_chat(data.chat_id);
             load_chats();
 
@@ -371,6 +433,16 @@ function get_ai_response(event) {
         .then(response => {
             console.log('Response status:', response.status);
 
+            if (response.status === 409) {
+                // the chat's index is not ready (still building or failed)
+                return response.json().then(errorData => {
+                    const error = new Error(`Error ${response.status}: ${errorData.error}`);
+                    error.user_message = errorData.index_error ? `${errorData.error}: ${errorData.index_error}` : `${errorData.error}, please wait until the knowledge base is indexed.`;
+                    error.chat_id = chat_id;
+                    throw error;
+                });
+            }
+
             if (!response.ok) {
                 return response.json().then(errorData => {
                     throw new Error(`Error ${response.status}: ${errorData.message || response.statusText}`);
@@ -414,11 +486,16 @@ function get_ai_response(event) {
         })
         .catch(error => {
             console.error('Error:', error);
-            alert('An error occurred, please try again.');
+            alert(error.user_message || 'An error occurred, please try again.');
 
             // reset form
             submit_button.innerHTML = submit_button_text;
             submit_button.disabled = false;
+
+            // keep the form disabled until the index is ready
+            if (error.chat_id) {
+                wait_for_index(error.chat_id);
+            }
         });
 
 